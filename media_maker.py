@@ -2,51 +2,218 @@
 
 import os
 import re
+import time
+import queue
+import atexit
 import argparse
+import threading
 import subprocess
 import concurrent.futures
+import contextlib
 from pathlib import Path
 import whisper
+import torch
+import numpy as np
 import requests
 import datetime
 import shutil
+import shlex
+import sqlite3
+import hashlib
+import collections
+import json
+import logging
+import logging.handlers
+
+# Notifications waiting to be sent. When it is full new ones are dropped, so a
+# slow or dead ntfy server can never hold up an encode.
+NOTIFY_QUEUE_SIZE = 1000
+
+# Messages with the same title arriving within this window go out as one digest
+NOTIFY_COALESCE_SECONDS = 5
+
+# Minimum gap between two posts with the same title
+NOTIFY_MIN_INTERVAL = 15
+
+# How long to wait at exit for queued notifications to go out
+NOTIFY_FLUSH_TIMEOUT = 15
+
+NOTIFY_QUEUE = queue.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+NOTIFY_THREAD = None
+NOTIFY_LOCK = threading.Lock()
+NOTIFY_STOP = object()
 
 def NotifyMe(title: str = 'New Message', priority: str = '3', tags: str = 'incoming_envelope', message: str = 'No message included'):
-    NTFY_PATH = os.path.join(os.environ['HOME'], '.config', '.credentials', 'ntfy.url')
-    with open(NTFY_PATH, 'r') as file:
-        NTFY_URL = file.readline().strip()
+    # Hand the notification to the background dispatcher and return right away
+    global NOTIFY_THREAD
+    with NOTIFY_LOCK:
+        if NOTIFY_THREAD is None:
+            NOTIFY_THREAD = threading.Thread(target=notification_dispatcher, name="notify", daemon=True)
+            NOTIFY_THREAD.start()
+            atexit.register(flush_notifications)
+    try:
+        NOTIFY_QUEUE.put_nowait((title, str(priority), tags, message))
+    except queue.Full:
+        pass
+
+def flush_notifications(timeout=NOTIFY_FLUSH_TIMEOUT):
+    # Send whatever is still pending, waiting at most timeout seconds
+    if NOTIFY_THREAD is None or not NOTIFY_THREAD.is_alive():
+        return
+    try:
+        NOTIFY_QUEUE.put(NOTIFY_STOP, timeout=timeout)
+    except queue.Full:
+        return
+    NOTIFY_THREAD.join(timeout)
 
+def send_digest(session, url, title, batch):
+    messages = batch["messages"]
+    if len(messages) == 1:
+        body = messages[0]
+    else:
+        body = f"{len(messages)} updates:\n" + "\n".join(f"• {message}" for message in messages)
     headers = {
         "Title": title,
-        "Priority": priority,
-        "Tags": tags
+        "Priority": batch["priority"],
+        "Tags": batch["tags"]
     }
+    session.post(url, data=(f"{body}\n").encode(encoding='utf-8'), headers=headers, timeout=10)
 
-    data = (f"{message}\n").encode(encoding='utf-8')
-    requests.post(NTFY_URL, data=data, headers=headers)
+def notification_dispatcher():
+    # Runs on its own thread: coalesces bursts per title into digests, keeps
+    # posts per title at least NOTIFY_MIN_INTERVAL apart, and swallows any
+    # delivery error so notifications never take an encode down with them
+    NTFY_PATH = os.path.join(os.environ['HOME'], '.config', '.credentials', 'ntfy.url')
+    try:
+        with open(NTFY_PATH, 'r') as file:
+            NTFY_URL = file.readline().strip()
+    except OSError:
+        NTFY_URL = None
+    session = requests.Session()
 
-def LogIt(LOG: str = None, message: str = None, LEVEL: str = 'info'):
-    import logging
-    log_directory = '/opt/whisper/logs'
-    os.makedirs(log_directory, exist_ok=True)
+    pending = {}
+    last_sent = {}
+    stopping = False
+    while True:
+        now = time.monotonic()
+        due = {title: max(batch["first"] + NOTIFY_COALESCE_SECONDS, last_sent.get(title, 0) + NOTIFY_MIN_INTERVAL)
+               for title, batch in pending.items()}
+        if not stopping:
+            timeout = max(0.0, min(due.values()) - now) if due else None
+            try:
+                item = NOTIFY_QUEUE.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            if item is NOTIFY_STOP:
+                stopping = True
+            elif item is not None:
+                title, priority, tags, message = item
+                batch = pending.setdefault(title, {"first": time.monotonic(), "priority": priority, "tags": tags, "messages": []})
+                batch["priority"] = max(batch["priority"], priority)
+                batch["messages"].append(message)
+                continue
+
+        now = time.monotonic()
+        for title in list(pending):
+            if stopping or now >= due.get(title, now):
+                batch = pending.pop(title)
+                last_sent[title] = now
+                if NTFY_URL:
+                    try:
+                        send_digest(session, NTFY_URL, title, batch)
+                    except Exception:
+                        pass
+        if stopping:
+            return
+
+LOG_DIRECTORY = '/opt/whisper/logs'
+
+LOG_LEVELS = {
+    'debug': logging.DEBUG,
+    'info': logging.INFO,
+    'warn': logging.WARNING,
+    'warning': logging.WARNING,
+    'error': logging.ERROR,
+    'critical': logging.CRITICAL
+}
+
+# Every record goes onto this queue and is written out by one listener thread,
+# so a log call from an encoder thread costs an enqueue and nothing more
+LOG_QUEUE = queue.SimpleQueue()
+LOG_LISTENER = None
+LOG_LOCK = threading.Lock()
+
+class JsonLineFormatter(logging.Formatter):
+    # One JSON object per line: when, which log, and the event's own fields
+    def format(self, record):
+        event = {"time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+                 "log": record.name}
+        event.update(record.event)
+        return json.dumps(event, default=str)
 
+class LogRouter(logging.Handler):
+    # Runs on the listener thread. Human-readable records go to the file named
+    # after their logger, job events to a .jsonl file next to it; the files
+    # are opened the first time each log is written to.
+    def __init__(self):
+        super().__init__()
+        self.files = {}
+
+    def file_handler(self, name, structured):
+        key = (name, structured)
+        handler = self.files.get(key)
+        if handler is None:
+            if structured:
+                handler = logging.FileHandler(f'{LOG_DIRECTORY}/{Path(name).stem}.jsonl', mode='a', encoding='utf-8')
+                handler.setFormatter(JsonLineFormatter())
+            else:
+                handler = logging.FileHandler(f'{LOG_DIRECTORY}/{name}', mode='a', encoding='utf-8')
+                handler.setFormatter(logging.Formatter('%(asctime)s:%(levelname)s :::[ %(name)s ]::: %(message)s'))
+            self.files[key] = handler
+        return handler
+
+    def emit(self, record):
+        self.file_handler(record.name, hasattr(record, "event")).handle(record)
+
+    def close(self):
+        for handler in self.files.values():
+            handler.close()
+        super().close()
+
+def start_logging():
+    # Configure the queue and its writer thread once; every logger created
+    # after this only needs a QueueHandler
+    global LOG_LISTENER
+    with LOG_LOCK:
+        if LOG_LISTENER is None:
+            os.makedirs(LOG_DIRECTORY, exist_ok=True)
+            LOG_LISTENER = logging.handlers.QueueListener(LOG_QUEUE, LogRouter())
+            LOG_LISTENER.start()
+            atexit.register(stop_logging)
+
+def stop_logging():
+    # Drain the queue and close the files
+    global LOG_LISTENER
+    with LOG_LOCK:
+        if LOG_LISTENER is not None:
+            LOG_LISTENER.stop()
+            LOG_LISTENER.handlers[0].close()
+            LOG_LISTENER = None
+
+def get_logger(LOG):
     logger = logging.getLogger(LOG)
+    if not logger.handlers:
+        start_logging()
+        with LOG_LOCK:
+            if not logger.handlers:
+                logger.setLevel(logging.DEBUG)
+                logger.propagate = False
+                logger.addHandler(logging.handlers.QueueHandler(LOG_QUEUE))
+    return logger
 
-    if not logger.hasHandlers():
-        logger.setLevel(logging.DEBUG)
-        formatter = logging.Formatter('%(asctime)s:%(levelname)s :::[ ' + f'{LOG}' + ' ]::: %(message)s')
-        file_handler = logging.FileHandler(f'{log_directory}/{LOG}', mode='a', encoding='utf-8')
-        file_handler.setFormatter(formatter)
-        logger.addHandler(file_handler)
-
-    log_level = {
-        'debug': logging.DEBUG,
-        'info': logging.INFO,
-        'warn': logging.WARNING,
-        'warning': logging.WARNING,
-        'error': logging.ERROR,
-        'critical': logging.CRITICAL
-    }.get(LEVEL.lower(), logging.INFO)
+def LogIt(LOG: str = None, message: str = None, LEVEL: str = 'info'):
+    logger = get_logger(LOG)
+    log_level = LOG_LEVELS.get(LEVEL.lower(), logging.INFO)
 
     if message:
         logger.log(log_level, message)
@@ -55,73 +222,1072 @@ def LogIt(LOG: str = None, message: str = None, LEVEL: str = 'info'):
 
     return logger
 
-def validate_imdb_id(imdb_id):
-    if not re.match(r'^tt\d{7,9}$', imdb_id):
-        raise ValueError("Invalid IMDB ID format. Expected: tt1234567")
+def LogEvent(LOG: str = None, phase: str = None, title: str = None, rung: str = None, duration: float = None, **fields):
+    # Structured job event, written as a JSON line to the job's .jsonl log
+    event = {"title": title, "rung": rung, "phase": phase}
+    if duration is not None:
+        event["duration"] = round(duration, 3)
+    event.update(fields)
+    get_logger(LOG).info(phase, extra={"event": event})
 
-    headers = {"User-Agent": "Mozilla/5.0"}
-    url = f"https://www.imdb.com/title/{imdb_id}/"
-    resp = requests.get(url, headers=headers)
-    if resp.status_code != 200:
-        raise ValueError(f"IMDB ID not found: {imdb_id}")
-    return imdb_id
+# SQLite databases whose schema this process has already set up
+SQLITE_SCHEMAS = set()
+SQLITE_SCHEMA_LOCK = threading.Lock()
 
-def imdb_name(imdb_id):
-    headers = {"User-Agent": "Mozilla/5.0"}
-    html = requests.get(f"https://www.imdb.com/title/{imdb_id}/", headers=headers).text
+@contextlib.contextmanager
+def sqlite_connection(path, schema, wal=False):
+    # One short-lived connection per call, committed on success and always
+    # closed; the pragma and schema script only run the first time a path is
+    # opened
+    conn = sqlite3.connect(path, timeout=60)
+    try:
+        with SQLITE_SCHEMA_LOCK:
+            if path not in SQLITE_SCHEMAS:
+                if wal:
+                    conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(schema)
+                SQLITE_SCHEMAS.add(path)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+# Where title pages are fetched from; point it at a local stand-in for testing
+IMDB_BASE_URL = "https://www.imdb.com"
+
+# Resolved titles are cached here and trusted for IMDB_CACHE_TTL seconds
+IMDB_CACHE_PATH = '/opt/whisper/imdb_cache.db'
+IMDB_CACHE_TTL = 30 * 24 * 3600
+
+# Never touch the network; only cached titles resolve
+IMDB_OFFLINE = False
+
+IMDB_SESSION = None
+IMDB_SESSION_LOCK = threading.Lock()
+
+def imdb_session():
+    # One pooled session for every lookup in this process
+    global IMDB_SESSION
+    with IMDB_SESSION_LOCK:
+        if IMDB_SESSION is None:
+            IMDB_SESSION = requests.Session()
+            IMDB_SESSION.headers.update({"User-Agent": "Mozilla/5.0"})
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16, max_retries=2)
+            IMDB_SESSION.mount("https://", adapter)
+            IMDB_SESSION.mount("http://", adapter)
+        return IMDB_SESSION
+
+IMDB_CACHE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS imdb_titles (
+    imdb_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    year TEXT NOT NULL,
+    fetched_at REAL NOT NULL
+);
+"""
+
+def open_imdb_cache():
+    return sqlite_connection(IMDB_CACHE_PATH, IMDB_CACHE_SCHEMA)
+
+def parse_imdb_page(html):
+    # Title and year both come from the page's <title>, e.g. "The Thing (1982) - IMDb"
     match = re.search(r'<title>(.*?) - IMDb</title>', html)
     title = match.group(1) if match else "Unknown Title"
+    match = re.search(r'\((\d{4})\)$', title.strip())
+    year = match.group(1) if match else "0000"
     title = re.sub(r'\s+\(\d{4}\)$', '', title.strip())
     if title.lower().startswith("the "):
         title = f"{title[4:]}, The"
-    return title
+    return title, year
+
+def resolve_imdb(imdb_id):
+    # Validate the ID and return (name, year), fetching the title page at most
+    # once per ID and TTL. In offline mode only the cache is consulted.
+    if not re.match(r'^tt\d{7,9}$', imdb_id):
+        raise ValueError("Invalid IMDB ID format. Expected: tt1234567")
+
+    with open_imdb_cache() as conn:
+        cached = conn.execute("SELECT name, year, fetched_at FROM imdb_titles WHERE imdb_id = ?", (imdb_id,)).fetchone()
+    if cached and (IMDB_OFFLINE or time.time() - cached[2] < IMDB_CACHE_TTL):
+        return cached[0], cached[1]
+    if IMDB_OFFLINE:
+        raise ValueError(f"IMDB ID not in the offline cache: {imdb_id}")
+
+    try:
+        resp = imdb_session().get(f"{IMDB_BASE_URL}/title/{imdb_id}/", timeout=30)
+    except requests.RequestException:
+        if cached:
+            # A stale answer beats failing the whole job
+            return cached[0], cached[1]
+        raise
+    if resp.status_code != 200:
+        if cached:
+            # Rate limited, an outage or a page pulled: the stale answer still beats failing the job
+            return cached[0], cached[1]
+        if resp.status_code == 404:
+            raise ValueError(f"IMDB ID not found: {imdb_id}")
+        raise ValueError(f"IMDB lookup for {imdb_id} failed with HTTP {resp.status_code}")
+
+    name, year = parse_imdb_page(resp.text)
+    with open_imdb_cache() as conn:
+        conn.execute("INSERT OR REPLACE INTO imdb_titles (imdb_id, name, year, fetched_at) VALUES (?, ?, ?, ?)",
+                     (imdb_id, name, year, time.time()))
+    return name, year
+
+def validate_imdb_id(imdb_id):
+    resolve_imdb(imdb_id)
+    return imdb_id
+
+def imdb_name(imdb_id):
+    return resolve_imdb(imdb_id)[0]
 
 def imdb_year(imdb_id):
-    headers = {"User-Agent": "Mozilla/5.0"}
-    html = requests.get(f"https://www.imdb.com/title/{imdb_id}/", headers=headers).text
-    match = re.search(r'<title>.*\((\d{4})\) - IMDb</title>', html)
-    return match.group(1) if match else "0000"
+    return resolve_imdb(imdb_id)[1]
 
-def encode_rung(source_path, output_path, width, height, bitrate, imdb_id, imdb_name, imdb_year, LOGGER):
-    profile = "main10:level=6.0" if width == 3840 and height == 2160 else "main10:level=5.1"
-    file_name = f"{imdb_name} ({imdb_year}) {{imdb-{imdb_id}}} - {height}p.mkv"
-    final_output = output_path / file_name
+def rung_file_name(imdb_id, imdb_name, imdb_year, height):
+    return f"{imdb_name} ({imdb_year}) {{imdb-{imdb_id}}} - {height}p.mkv"
 
-    NotifyMe(title="Encode Status", message=f"Started encoding {file_name} …")
-    LogIt(LOGGER, f"Encoding {file_name} ({width}x{height} @ {bitrate}kbps)", "info")
+# Start child processes (HandBrake, ffmpeg, ffprobe, ssh) in their own
+# session, so a Ctrl-C at the terminal reaches only this process. Watch mode
+# turns it on so Ctrl-C stops watching without killing the encodes in flight.
+DETACH_CHILDREN = False
+
+# Suffix encoders write to until the output is complete; it never matches *.mkv
+PARTIAL_SUFFIX = ".part"
+
+# Title and rung progress, shared by every run so a restart resumes a title
+JOB_DB_PATH = '/opt/whisper/jobs.db'
+
+JOB_STORE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS titles (
+        imdb_id TEXT PRIMARY KEY,
+        name TEXT,
+        year TEXT,
+        source TEXT,
+        output_dir TEXT,
+        state TEXT NOT NULL,
+        updated_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS rungs (
+        imdb_id TEXT NOT NULL,
+        width INTEGER NOT NULL,
+        height INTEGER NOT NULL,
+        bitrate INTEGER NOT NULL,
+        file_name TEXT NOT NULL,
+        state TEXT NOT NULL,
+        exit_code INTEGER,
+        size INTEGER,
+        checksum TEXT,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (imdb_id, width, height, bitrate)
+    );
+'''
+
+def open_job_store(path=None):
+    # Short-lived connections keep this safe to call from any encoder thread
+    return sqlite_connection(path or JOB_DB_PATH, JOB_STORE_SCHEMA, wal=True)
+
+def record_title(imdb_id, state, name=None, year=None, source=None, output_dir=None):
+    with open_job_store() as conn:
+        conn.execute('''
+            INSERT INTO titles (imdb_id, name, year, source, output_dir, state, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (imdb_id) DO UPDATE SET
+                name = coalesce(excluded.name, name),
+                year = coalesce(excluded.year, year),
+                source = coalesce(excluded.source, source),
+                output_dir = coalesce(excluded.output_dir, output_dir),
+                state = excluded.state,
+                updated_at = excluded.updated_at
+        ''', (imdb_id, name, year, None if source is None else str(source),
+              None if output_dir is None else str(output_dir), state, datetime.datetime.now().isoformat()))
+
+def record_rung(imdb_id, width, height, bitrate, file_name, state, exit_code=None, size=None, checksum=None):
+    with open_job_store() as conn:
+        conn.execute('''
+            INSERT OR REPLACE INTO rungs (imdb_id, width, height, bitrate, file_name, state, exit_code, size, checksum, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (imdb_id, width, height, bitrate, file_name, state, exit_code, size, checksum,
+              datetime.datetime.now().isoformat()))
+
+def rung_is_done(imdb_id, width, height, bitrate, final_output):
+    # A rung only counts as done if the store says so and the file it recorded is still there, whole
+    with open_job_store() as conn:
+        row = conn.execute('''
+            SELECT size FROM rungs
+            WHERE imdb_id = ? AND width = ? AND height = ? AND bitrate = ? AND state IN ('done', 'verified')
+        ''', (imdb_id, width, height, bitrate)).fetchone()
+    return row is not None and final_output.is_file() and final_output.stat().st_size == row[0]
+
+def rung_checksum(imdb_id, width, height, bitrate):
+    with open_job_store() as conn:
+        row = conn.execute('''
+            SELECT checksum FROM rungs WHERE imdb_id = ? AND width = ? AND height = ? AND bitrate = ?
+        ''', (imdb_id, width, height, bitrate)).fetchone()
+    return row[0] if row else None
+
+def update_rung(imdb_id, width, height, bitrate, state, checksum=None):
+    with open_job_store() as conn:
+        conn.execute('''
+            UPDATE rungs SET state = ?, checksum = COALESCE(?, checksum), updated_at = ?
+            WHERE imdb_id = ? AND width = ? AND height = ? AND bitrate = ?
+        ''', (state, checksum, datetime.datetime.now().isoformat(), imdb_id, width, height, bitrate))
+
+def file_checksum(path):
+    with open(path, "rb") as f:
+        return hashlib.file_digest(f, "sha256").hexdigest()
+
+def partial_output(final_output):
+    return final_output.with_name(final_output.name + PARTIAL_SUFFIX)
+
+def publish_rung(final_output, exit_code, imdb_id, width, height, bitrate):
+    # Move a finished encode from its partial name into place and record the
+    # outcome; a failed or empty encode is discarded instead. The checksum is
+    # taken by verify_rung, so hashing doesn't hold the encoder's slots.
+    partial = partial_output(final_output)
+    if exit_code == 0 and partial.is_file() and partial.stat().st_size > 0:
+        size = partial.stat().st_size
+        os.replace(partial, final_output)
+        record_rung(imdb_id, width, height, bitrate, final_output.name, "done", exit_code, size)
+        return True
+    partial.unlink(missing_ok=True)
+    record_rung(imdb_id, width, height, bitrate, final_output.name, "failed", exit_code)
+    return False
+
+# Live per-rung progress is exported here for node_exporter's textfile
+# collector; a path ending in .json writes a JSON status file instead
+METRICS_PATH = '/opt/whisper/metrics/media_maker.prom'
+
+# Progress updates rewrite the export at most this often; starts and
+# finishes always rewrite it
+METRICS_WRITE_INTERVAL = 5
+
+# Lines of encoder stderr kept for the failure log
+STDERR_TAIL_LINES = 200
+
+# "Encoding: task 1 of 1, 45.67 % (112.34 fps, avg 98.76 fps, ETA 00h12m34s)";
+# the bracketed part only appears once HandBrake has a rate estimate
+HANDBRAKE_PROGRESS = re.compile(
+    r"Encoding: task \d+ of \d+, (?P<percent>[\d.]+) %"
+    r"(?: \((?P<fps>[\d.]+) fps, avg (?P<avg_fps>[\d.]+) fps, ETA (?P<h>\d+)h(?P<m>\d+)m(?P<s>\d+)s\))?"
+)
+
+RUNG_METRICS = {}
+METRICS_LOCK = threading.Lock()
+METRICS_WRITTEN = 0.0
+
+def rung_label(height, bitrate):
+    return f"{height}p@{bitrate}k"
+
+def parse_handbrake_progress(line):
+    match = HANDBRAKE_PROGRESS.search(line)
+    if not match:
+        return None
+    progress = {"percent": float(match["percent"])}
+    if match["fps"]:
+        progress["fps"] = float(match["fps"])
+        progress["avg_fps"] = float(match["avg_fps"])
+        progress["eta_seconds"] = int(match["h"]) * 3600 + int(match["m"]) * 60 + int(match["s"])
+    return progress
+
+def track_rung(imdb_id, rung, **fields):
+    # Update a rung's entry in the registry and export it if it is due
+    now = time.time()
+    with METRICS_LOCK:
+        entry = RUNG_METRICS.setdefault((imdb_id, rung), {"started": now})
+        state_changed = "state" in fields and fields["state"] != entry.get("state")
+        entry.update(fields)
+        if "percent" in fields:
+            entry["progress_at"] = now
+        if state_changed or now - METRICS_WRITTEN >= METRICS_WRITE_INTERVAL:
+            write_metrics(now)
+
+def prometheus_metrics():
+    gauges = [
+        ("progress_percent", "percent", "Percent of the rung encoded"),
+        ("fps", "fps", "Current encode rate in frames per second"),
+        ("avg_fps", "avg_fps", "Average encode rate in frames per second"),
+        ("eta_seconds", "eta_seconds", "Encoder's estimate of the time left"),
+        ("started_timestamp_seconds", "started", "When the rung started encoding"),
+        ("last_progress_timestamp_seconds", "progress_at", "When the encoder last reported progress; a stalled encode stops moving this"),
+    ]
+    lines = []
+    for name, field, help_text in gauges:
+        lines += [f"# HELP media_maker_rung_{name} {help_text}", f"# TYPE media_maker_rung_{name} gauge"]
+        for (imdb_id, rung), entry in sorted(RUNG_METRICS.items()):
+            if entry.get(field) is not None:
+                lines.append(f'media_maker_rung_{name}{{imdb_id="{imdb_id}",rung="{rung}",engine="{entry.get("engine", "")}"}} {entry[field]}')
+    lines += ["# HELP media_maker_rung_state Current state of the rung", "# TYPE media_maker_rung_state gauge"]
+    for (imdb_id, rung), entry in sorted(RUNG_METRICS.items()):
+        for state in ("running", "done", "verified", "failed"):
+            lines.append(f'media_maker_rung_state{{imdb_id="{imdb_id}",rung="{rung}",state="{state}"}} {int(entry.get("state") == state)}')
+    return "\n".join(lines) + "\n"
 
+def write_metrics(now=None):
+    # Called with METRICS_LOCK held. Written to a temporary file and renamed so
+    # the collector never reads a half-written export.
+    global METRICS_WRITTEN
+    METRICS_WRITTEN = now or time.time()
+    if not METRICS_PATH:
+        return
+    path = Path(METRICS_PATH)
+    if path.suffix == ".json":
+        body = json.dumps([{"imdb_id": imdb_id, "rung": rung, **entry}
+                           for (imdb_id, rung), entry in sorted(RUNG_METRICS.items())], indent=2)
+    else:
+        body = prometheus_metrics()
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary = path.with_name(f".{path.name}.{os.getpid()}")
+        temporary.write_text(body, encoding="utf-8")
+        os.replace(temporary, path)
+    except OSError:
+        pass
+
+def handbrake_command(input_path, output_path, width, height, bitrate, audio=True):
+    profile = "main10:level=6.0" if width == 3840 and height == 2160 else "main10:level=5.1"
     command = [
         "HandBrakeCLI",
-        "--input", str(source_path),
-        "--output", str(final_output),
+        "--input", str(input_path),
+        "--output", str(output_path),
         "--encoder", "nvenc_h265_10bit",
         "--vb", str(bitrate),
         "--width", str(width),
         "--height", str(height),
-        "--aencoder", "av_aac",
-        "--audio", "1",
-        "--mixdown", "stereo",
-        "--ab", "128",
+    ]
+    if audio:
+        command += ["--aencoder", "av_aac", "--audio", "1", "--mixdown", "stereo", "--ab", "128"]
+    else:
+        command += ["--audio", "none"]
+    command += [
         "--format", "mkv",
         "--optimize",
         "--x265-preset", "fast",
         f"--encopts={profile}"
     ]
+    return command
+
+def encode_rung(source_path, output_path, width, height, bitrate, imdb_id, imdb_name, imdb_year, LOGGER):
+    file_name = rung_file_name(imdb_id, imdb_name, imdb_year, height)
+    final_output = output_path / file_name
+
+    NotifyMe(title="Encode Status", message=f"Started encoding {file_name} …")
+    LogIt(LOGGER, f"Encoding {file_name} ({width}x{height} @ {bitrate}kbps)", "info")
 
+    record_rung(imdb_id, width, height, bitrate, file_name, "running")
+    rung = rung_label(height, bitrate)
+    track_rung(imdb_id, rung, engine="handbrake", state="running")
+    started = time.monotonic()
+    command = handbrake_command(source_path, partial_output(final_output), width, height, bitrate)
+
+    # HandBrake rewrites its progress line on stdout with carriage returns,
+    # which text mode turns into separate lines; its log goes to stderr, of
+    # which only the tail is kept for the failure message
+    stderr_tail = collections.deque(maxlen=STDERR_TAIL_LINES)
     try:
-        OUTPUT = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        if OUTPUT.returncode == 0:
+        with subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, errors="replace", start_new_session=DETACH_CHILDREN) as process:
+            stderr_reader = threading.Thread(target=stderr_tail.extend, args=(process.stderr,), daemon=True)
+            stderr_reader.start()
+            for line in process.stdout:
+                progress = parse_handbrake_progress(line)
+                if progress:
+                    track_rung(imdb_id, rung, **progress)
+            process.wait()
+            stderr_reader.join()
+        ok = publish_rung(final_output, process.returncode, imdb_id, width, height, bitrate)
+        track_rung(imdb_id, rung, state="done" if ok else "failed", exit_code=process.returncode)
+        LogEvent(LOGGER, "encode", imdb_id, rung, time.monotonic() - started,
+                 engine="handbrake", exit_code=process.returncode, ok=ok)
+        if ok:
             LogIt(LOGGER, f"✅ Done: {file_name}", "info")
             NotifyMe(title="Encode Status", message=f"Encoding {file_name} is complete!")
             return True
         else:
-            LogIt(LOGGER, f"❌ Encode failed for {file_name} with return code {OUTPUT.returncode}", "error")
-            LogIt(LOGGER, f"STDERR:\n{OUTPUT.stderr}", "debug")
+            LogIt(LOGGER, f"❌ Encode failed for {file_name} with return code {process.returncode}", "error")
+            LogIt(LOGGER, "STDERR:\n" + "".join(stderr_tail), "debug")
             return False
     except Exception as exc:
         LogIt(LOGGER, f"❌ Exception while encoding {file_name}: {exc}", "critical")
+        publish_rung(final_output, None, imdb_id, width, height, bitrate)
+        track_rung(imdb_id, rung, state="failed", exit_code=None)
+        LogEvent(LOGGER, "encode", imdb_id, rung, time.monotonic() - started,
+                 engine="handbrake", exit_code=None, ok=False)
         return False
 
+# Sleep per megapixel of output for the stub backend
+STUB_SECONDS_PER_MEGAPIXEL = 0.5
+
+def stub_encode_rung(source_path, output_path, width, height, bitrate, imdb_id, imdb_name, imdb_year, LOGGER):
+    # Stand-in encoder for exercising the scheduler without a GPU or HandBrake:
+    # sleeps for a time proportional to the rung's size and writes a placeholder
+    file_name = rung_file_name(imdb_id, imdb_name, imdb_year, height)
+    final_output = output_path / file_name
+    LogIt(LOGGER, f"Stub encoding {file_name} ({width}x{height} @ {bitrate}kbps)", "info")
+    record_rung(imdb_id, width, height, bitrate, file_name, "running")
+    rung = rung_label(height, bitrate)
+    track_rung(imdb_id, rung, engine="stub", state="running")
+    started = time.monotonic()
+    time.sleep(STUB_SECONDS_PER_MEGAPIXEL * width * height / 1_000_000)
+    partial_output(final_output).write_bytes(b"stub encode\n")
+    publish_rung(final_output, 0, imdb_id, width, height, bitrate)
+    track_rung(imdb_id, rung, state="done", percent=100.0, exit_code=0)
+    LogEvent(LOGGER, "encode", imdb_id, rung, time.monotonic() - started,
+             engine="stub", exit_code=0, ok=True)
+    LogIt(LOGGER, f"✅ Done: {file_name}", "info")
+    return True
+
+# Segmented encoding: big rungs are cut at keyframes into this many pieces,
+# encoded side by side and joined back together. Rungs shorter than
+# SEGMENT_MIN_HEIGHT are quick enough to encode whole.
+SEGMENT_COUNT = 8
+SEGMENT_MIN_HEIGHT = 1080
+
+# Concurrent segment encodes: in total for the local transport, per node for remote ones
+SEGMENT_WORKERS = 2
+
+# Source segments and encoded segments are kept here until the title is done
+SEGMENT_WORK_DIR = '/opt/whisper/segments'
+
+# Scratch directory on remote nodes
+SEGMENT_REMOTE_DIR = '/tmp/media_maker_segments'
+
+# Set by main() to one of SEGMENT_TRANSPORTS when the segmented backend is used
+SEGMENT_TRANSPORT = None
+
+SEGMENT_SPLITS = {}
+SEGMENT_LOCK = threading.Lock()
+
+def encode_segment(input_path, output_path, width, height, bitrate, runner=()):
+    # Video only: the audio is encoded once for the whole title when the
+    # segments are joined. runner prefixes the command, e.g. ["ssh", node].
+    command = handbrake_command(input_path, output_path, width, height, bitrate, audio=False)
+    if runner:
+        command = [*runner, shlex.join(command)]
+    OUTPUT = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace", start_new_session=DETACH_CHILDREN)
+    return OUTPUT.returncode, OUTPUT.stderr[-4000:]
+
+class LocalTransport:
+    # Segment encodes as HandBrakeCLI processes on this machine, at most
+    # `workers` at a time. Transports that encode here say so with
+    # runs_locally, and the scheduler charges them all `workers` sessions.
+    runs_locally = True
+
+    def __init__(self, workers, nodes=None):
+        self.workers = workers
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="segment")
+
+    def submit(self, input_path, output_path, width, height, bitrate):
+        return self.pool.submit(encode_segment, input_path, output_path, width, height, bitrate)
+
+class SshTransport:
+    # Segment encodes on other machines: each job takes a free node, copies
+    # its segment over, runs HandBrakeCLI there and copies the result back.
+    # Nodes need HandBrakeCLI and key-based ssh. The put/run/get/remove steps
+    # are the whole transport, so other ways of reaching a node only need to
+    # replace those.
+    runs_locally = False
+
+    def __init__(self, workers, nodes=None):
+        if not nodes:
+            raise ValueError("the ssh transport needs at least one node")
+        self.workers = workers * len(nodes)
+        self.nodes = queue.Queue()
+        for node in nodes * workers:
+            self.nodes.put(node)
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="segment")
+
+    def submit(self, input_path, output_path, width, height, bitrate):
+        return self.pool.submit(self.encode, Path(input_path), Path(output_path), width, height, bitrate)
+
+    def encode(self, input_path, output_path, width, height, bitrate):
+        node = self.nodes.get()
+        job = hashlib.sha1(str(output_path).encode()).hexdigest()[:12]
+        remote_input, remote_output = self.scratch(node, f"{job}-in.mkv"), self.scratch(node, f"{job}-out.mkv")
+        try:
+            self.put(node, input_path, remote_input)
+            exit_code, stderr = self.run(node, remote_input, remote_output, width, height, bitrate)
+            if exit_code == 0:
+                self.get(node, remote_output, output_path)
+            return exit_code, stderr
+        finally:
+            self.remove(node, remote_input, remote_output)
+            self.nodes.put(node)
+
+    def scratch(self, node, name):
+        return f"{SEGMENT_REMOTE_DIR}/{name}"
+
+    def put(self, node, local, remote):
+        subprocess.run(["ssh", node, shlex.join(["mkdir", "-p", SEGMENT_REMOTE_DIR])], check=True, stdin=subprocess.DEVNULL, start_new_session=DETACH_CHILDREN)
+        subprocess.run(["scp", "-q", str(local), f"{node}:{remote}"], check=True, stdin=subprocess.DEVNULL, start_new_session=DETACH_CHILDREN)
+
+    def run(self, node, remote_input, remote_output, width, height, bitrate):
+        return encode_segment(remote_input, remote_output, width, height, bitrate, runner=("ssh", node))
+
+    def get(self, node, remote, local):
+        subprocess.run(["scp", "-q", f"{node}:{remote}", str(local)], check=True, stdin=subprocess.DEVNULL, start_new_session=DETACH_CHILDREN)
+
+    def remove(self, node, *paths):
+        subprocess.run(["ssh", node, shlex.join(["rm", "-f", *paths])], stdin=subprocess.DEVNULL,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=DETACH_CHILDREN)
+
+class LoopbackTransport(SshTransport):
+    # Stand-in for SshTransport without any other machines: each "node" is a
+    # local scratch directory, files are copied in and out of it and the
+    # encode runs here, so the remote path can be exercised end to end
+    runs_locally = True
+
+    def scratch(self, node, name):
+        return str(Path(node) / name)
+
+    def put(self, node, local, remote):
+        Path(node).mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(local, remote)
+
+    def run(self, node, remote_input, remote_output, width, height, bitrate):
+        return encode_segment(remote_input, remote_output, width, height, bitrate)
+
+    def get(self, node, remote, local):
+        shutil.copyfile(remote, local)
+
+    def remove(self, node, *paths):
+        for path in paths:
+            Path(path).unlink(missing_ok=True)
+
+SEGMENT_TRANSPORTS = {
+    "local": LocalTransport,
+    "ssh": SshTransport,
+    "loopback": LoopbackTransport,
+}
+
+def segment_directory(source_path):
+    return Path(SEGMENT_WORK_DIR) / hashlib.sha1(str(source_path).encode()).hexdigest()[:16]
+
+def cut_segments(source_path, LOGGER):
+    # Copy the video stream into SEGMENT_COUNT pieces, each starting on a
+    # keyframe so it decodes on its own; nothing is re-encoded
+    probe = probe_source(source_path)
+    if not probe or not probe["duration"]:
+        raise RuntimeError("could not read the source's duration")
+    directory = segment_directory(source_path)
+    shutil.rmtree(directory, ignore_errors=True)
+    directory.mkdir(parents=True)
+    command = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", str(source_path),
+        "-map", "0:v:0", "-c", "copy",
+        "-f", "segment", "-segment_time", f"{probe['duration'] / SEGMENT_COUNT:.3f}", "-reset_timestamps", "1",
+        str(directory / "segment%04d.mkv")
+    ]
+    started = time.monotonic()
+    OUTPUT = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace", start_new_session=DETACH_CHILDREN)
+    segments = sorted(directory.glob("segment*.mkv"))
+    if OUTPUT.returncode != 0 or not segments:
+        raise RuntimeError(f"ffmpeg exited with {OUTPUT.returncode}: {OUTPUT.stderr[-1000:]}")
+    LogEvent(LOGGER, "split", None, None, time.monotonic() - started, source=source_path.name, segments=len(segments))
+    return segments
+
+def split_source(source_path, LOGGER):
+    # Every segmented rung of a title shares one split, made by whichever rung
+    # asks first
+    with SEGMENT_LOCK:
+        future = SEGMENT_SPLITS.get(source_path)
+        owner = future is None
+        if owner:
+            future = SEGMENT_SPLITS[source_path] = concurrent.futures.Future()
+    if owner:
+        try:
+            future.set_result(cut_segments(source_path, LOGGER))
+        except Exception as exc:
+            future.set_exception(exc)
+    return future.result()
+
+def discard_segments(source_path):
+    with SEGMENT_LOCK:
+        SEGMENT_SPLITS.pop(source_path, None)
+    shutil.rmtree(segment_directory(source_path), ignore_errors=True)
+
+def join_segments(source_path, encoded, list_path, output):
+    # The concat demuxer joins the encoded video without re-encoding it; the
+    # audio is taken from the source and encoded once, as encode_rung would
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in encoded:
+            escaped = str(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+    command = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-f", "concat", "-safe", "0", "-i", str(list_path),
+        "-i", str(source_path),
+        "-map", "0:v:0", "-map", "1:a:0?",
+        "-c:v", "copy",
+        "-c:a", "aac", "-ac", "2", "-b:a", "128k",
+        "-f", "matroska", str(output)
+    ]
+    OUTPUT = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace", start_new_session=DETACH_CHILDREN)
+    return OUTPUT.returncode, OUTPUT.stderr[-4000:]
+
+def segmented_encode_rung(source_path, output_path, width, height, bitrate, imdb_id, imdb_name, imdb_year, LOGGER):
+    # Encode a big rung as keyframe-aligned segments spread over the segment
+    # transport's workers and join them into the file encode_rung would have
+    # written. Small rungs, and any rung whose segmented encode fails, go
+    # through encode_rung instead.
+    if height < SEGMENT_MIN_HEIGHT:
+        return encode_rung(source_path, output_path, width, height, bitrate, imdb_id, imdb_name, imdb_year, LOGGER)
+    file_name = rung_file_name(imdb_id, imdb_name, imdb_year, height)
+    final_output = output_path / file_name
+    try:
+        segments = split_source(source_path, LOGGER)
+    except Exception as exc:
+        LogIt(LOGGER, f"⚠️  Could not split {source_path.name} into segments ({exc}), encoding {file_name} whole", "warning")
+        return encode_rung(source_path, output_path, width, height, bitrate, imdb_id, imdb_name, imdb_year, LOGGER)
+
+    NotifyMe(title="Encode Status", message=f"Started encoding {file_name} in {len(segments)} segments …")
+    LogIt(LOGGER, f"Encoding {file_name} ({width}x{height} @ {bitrate}kbps) as {len(segments)} segments", "info")
+    record_rung(imdb_id, width, height, bitrate, file_name, "running")
+    rung = rung_label(height, bitrate)
+    track_rung(imdb_id, rung, engine="segmented", state="running", percent=0.0)
+    started = time.monotonic()
+
+    encoded_dir = segments[0].parent / rung
+    encoded_dir.mkdir(exist_ok=True)
+    encoded = [encoded_dir / segment.name for segment in segments]
+    futures = {SEGMENT_TRANSPORT.submit(segment, target, width, height, bitrate): segment
+               for segment, target in zip(segments, encoded)}
+    failure = None
+    finished = 0
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            exit_code, stderr = future.result()
+        except Exception as exc:
+            exit_code, stderr = None, str(exc)
+        if exit_code == 0:
+            finished += 1
+            track_rung(imdb_id, rung, percent=round(100 * finished / len(segments), 2))
+        elif failure is None:
+            failure = f"{futures[future].name} failed with return code {exit_code}", stderr
+            for pending in futures:
+                pending.cancel()
+
+    exit_code = None
+    if failure is None:
+        exit_code, stderr = join_segments(source_path, encoded, encoded_dir / "segments.txt", partial_output(final_output))
+        if exit_code != 0:
+            failure = f"joining the segments failed with return code {exit_code}", stderr
+    ok = publish_rung(final_output, exit_code, imdb_id, width, height, bitrate)
+    if not ok:
+        failure = failure or ("the joined output was missing or empty", stderr)
+    shutil.rmtree(encoded_dir, ignore_errors=True)
+    track_rung(imdb_id, rung, state="done" if ok else "failed", exit_code=exit_code)
+    LogEvent(LOGGER, "encode", imdb_id, rung, time.monotonic() - started,
+             engine="segmented", segments=len(segments), exit_code=exit_code, ok=ok)
+    if ok:
+        LogIt(LOGGER, f"✅ Done: {file_name}", "info")
+        NotifyMe(title="Encode Status", message=f"Encoding {file_name} is complete!")
+        return True
+    LogIt(LOGGER, f"❌ Segmented encode of {file_name}: {failure[0]}, encoding it whole instead", "error")
+    LogIt(LOGGER, f"STDERR:\n{failure[1]}", "debug")
+    return encode_rung(source_path, output_path, width, height, bitrate, imdb_id, imdb_name, imdb_year, LOGGER)
+
+# Encoder backends, all called as backend(source_path, output_path, width, height, bitrate, imdb_id, imdb_name, imdb_year, LOGGER)
+ENCODER_BACKENDS = {
+    "handbrake": encode_rung,
+    "stub": stub_encode_rung,
+    "segmented": segmented_encode_rung,
+}
+
+# Bitrate ladder as (resolution, kbps). --ladder replaces it with a JSON file
+# holding the same pairs, e.g. [["1920x1080", 5800], ["1280x720", 3500]]
+DEFAULT_LADDER = [
+    ("3840x2160", 25000),
+    ("1920x1080", 5800),
+    ("1920x1080", 4300),
+    ("1280x720", 3500),
+    ("1280x720", 2750),
+    ("720x404", 1750),
+    ("720x404", 1100),
+    ("512x288", 700),
+    ("384x216", 400)
+]
+
+# Transfer characteristics of HDR10 (PQ) and HLG sources
+HDR_TRANSFERS = {"smpte2084", "arib-std-b67"}
+
+# Length of the stretch from the middle of the source encoded to gauge its complexity
+COMPLEXITY_SAMPLE_SECONDS = 20
+
+# Bitrate the sample encode reaches on footage of ordinary complexity; the
+# sample's ratio to it scales the ladder, within COMPLEXITY_RANGE
+COMPLEXITY_REFERENCE_KBPS = 1500
+COMPLEXITY_RANGE = (0.6, 1.5)
+
+# Scaled bitrates are rounded to this, so a rerun plans the same rungs and
+# resumes them
+BITRATE_STEP = 50
+
+def load_ladder(path=None):
+    # Largest resolution and highest bitrate first, which is the order the
+    # rest of the job relies on
+    if not path:
+        ladder = DEFAULT_LADDER
+    else:
+        with open(path, encoding="utf-8") as f:
+            ladder = [(str(res).lower(), int(bitrate)) for res, bitrate in json.load(f)]
+    return sorted(ladder, key=lambda rung: (-int(rung[0].split("x")[1]), -rung[1]))
+
+def probe_source(source_path):
+    # Resolution, frame rate and HDR of the first video stream, the duration
+    # and the number of audio streams, or None if ffprobe is unavailable or
+    # can't read the file
+    if not shutil.which("ffprobe"):
+        return None
+    command = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=codec_type,width,height,avg_frame_rate,color_transfer:format=duration",
+        "-of", "json",
+        str(source_path)
+    ]
+    OUTPUT = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, start_new_session=DETACH_CHILDREN)
+    try:
+        probe = json.loads(OUTPUT.stdout)
+        stream = [stream for stream in probe["streams"] if stream.get("codec_type") == "video"][0]
+        numerator, _, denominator = stream.get("avg_frame_rate", "0/1").partition("/")
+        return {
+            "width": int(stream["width"]),
+            "height": int(stream["height"]),
+            "fps": round(float(numerator) / float(denominator), 3) if float(denominator or 0) else 0.0,
+            "hdr": stream.get("color_transfer") in HDR_TRANSFERS,
+            "duration": float(probe.get("format", {}).get("duration") or 0),
+            "audio_streams": sum(stream.get("codec_type") == "audio" for stream in probe["streams"]),
+        }
+    except (ValueError, KeyError, IndexError):
+        return None
+
+def sample_complexity(source_path, probe):
+    # Encode a short stretch from the middle of the source at a fixed quality;
+    # busy, grainy footage needs more bits for it than the reference
+    start = max(probe["duration"] / 2 - COMPLEXITY_SAMPLE_SECONDS / 2, 0)
+    command = [
+        "ffmpeg", "-nostdin", "-v", "error",
+        "-ss", f"{start:.3f}", "-t", str(COMPLEXITY_SAMPLE_SECONDS),
+        "-i", str(source_path),
+        "-map", "0:v:0", "-vf", "scale=-2:540",
+        "-c:v", "libx264", "-preset", "ultrafast", "-crf", "23",
+        "-f", "h264", "-"
+    ]
+    OUTPUT = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, start_new_session=DETACH_CHILDREN)
+    seconds = min(COMPLEXITY_SAMPLE_SECONDS, probe["duration"]) or COMPLEXITY_SAMPLE_SECONDS
+    if OUTPUT.returncode != 0 or not OUTPUT.stdout:
+        return 1.0
+    kbps = len(OUTPUT.stdout) * 8 / 1000 / seconds
+    low, high = COMPLEXITY_RANGE
+    return round(min(max(kbps / COMPLEXITY_REFERENCE_KBPS, low), high), 3)
+
+def plan_ladder(ladder, probe=None, complexity=1.0):
+    # The title's (width, height, bitrate) rungs: nothing larger than the
+    # source in both dimensions (letterboxed and 4:3 sources keep their
+    # matching rung), bitrates scaled by complexity. A source smaller than
+    # every rung still gets the smallest one.
+    rungs = []
+    for res, bitrate in ladder:
+        width, height = map(int, res.split("x"))
+        if probe and width > probe["width"] and height > probe["height"]:
+            continue
+        rungs.append((width, height, max(round(bitrate * complexity / BITRATE_STEP), 1) * BITRATE_STEP))
+    if not rungs and ladder:
+        width, height = map(int, ladder[-1][0].split("x"))
+        rungs.append((width, height, max(round(ladder[-1][1] * complexity / BITRATE_STEP), 1) * BITRATE_STEP))
+    return rungs
+
+# An encode's duration may differ from the source's by this much and still verify
+VERIFY_DURATION_TOLERANCE = 2.0
+
+# Finished rungs verified at once, alongside the encodes still running
+VERIFY_WORKERS = 4
+
+def probe_output(path):
+    # Stream counts and duration of an encoded file, or None if ffprobe can't read it
+    command = [
+        "ffprobe", "-v", "error",
+        "-show_entries", "stream=codec_type:format=duration",
+        "-of", "json",
+        str(path)
+    ]
+    OUTPUT = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, start_new_session=DETACH_CHILDREN)
+    try:
+        probe = json.loads(OUTPUT.stdout)
+        types = [stream.get("codec_type") for stream in probe["streams"]]
+        return {"video": types.count("video"), "audio": types.count("audio"),
+                "duration": float(probe["format"]["duration"])}
+    except (ValueError, KeyError, TypeError):
+        return None
+
+def verify_rung(final_output, source_probe, imdb_id, width, height, bitrate, LOGGER, inspect=True):
+    # A published rung only counts once it is non-empty, ffprobe reads one
+    # video stream (and audio if the source had any), its duration matches
+    # the source, and its checksum matches any recorded by an earlier run.
+    # A rung that fails is deleted and marked failed so a rerun encodes it again.
+    # Returns True or False, or None when ffprobe isn't installed: the rung is
+    # then kept as encoded but unverified, and so is the source. inspect=False
+    # is for placeholder outputs such as the stub's: they only get the size and
+    # checksum checks and come back None at best, so they never let the
+    # source go.
+    started = time.monotonic()
+    rung = rung_label(height, bitrate)
+    problems = []
+    if inspect and not shutil.which("ffprobe"):
+        LogIt(LOGGER, f"⚠️  Not verified: {final_output.name} (ffprobe is not installed)", "warning")
+        LogEvent(LOGGER, "verify", imdb_id, rung, time.monotonic() - started, ok=None, problems=["ffprobe missing"])
+        return None
+    if not final_output.is_file() or final_output.stat().st_size == 0:
+        problems.append("missing or empty")
+    elif inspect:
+        probe = probe_output(final_output)
+        if probe is None:
+            problems.append("ffprobe could not read it")
+        else:
+            if probe["video"] != 1:
+                problems.append(f"{probe['video']} video streams")
+            if source_probe and probe["audio"] != min(source_probe["audio_streams"], 1):
+                problems.append(f"{probe['audio']} audio streams")
+            if source_probe and source_probe["duration"] and abs(probe["duration"] - source_probe["duration"]) > VERIFY_DURATION_TOLERANCE:
+                problems.append(f"runs {probe['duration']:.1f}s against the source's {source_probe['duration']:.1f}s")
+    checksum = None
+    if not problems:
+        checksum = file_checksum(final_output)
+        recorded = rung_checksum(imdb_id, width, height, bitrate)
+        if recorded and recorded != checksum:
+            problems.append("checksum differs from the one recorded when it was verified")
+
+    ok = not problems
+    if ok and not inspect:
+        LogIt(LOGGER, f"⚠️  Not verified: {final_output.name} (placeholder output)", "warning")
+        LogEvent(LOGGER, "verify", imdb_id, rung, time.monotonic() - started, ok=None, problems=["placeholder"])
+        return None
+    if ok:
+        update_rung(imdb_id, width, height, bitrate, "verified", checksum)
+        LogIt(LOGGER, f"🔍 Verified: {final_output.name}", "info")
+    else:
+        final_output.unlink(missing_ok=True)
+        update_rung(imdb_id, width, height, bitrate, "failed")
+        LogIt(LOGGER, f"❌ Verification failed for {final_output.name}: {', '.join(problems)}", "error")
+    track_rung(imdb_id, rung, state="verified" if ok else "failed")
+    LogEvent(LOGGER, "verify", imdb_id, rung, time.monotonic() - started, ok=ok, problems=problems)
+    return ok
+
+# How many encodes may hold each resource at once. Consumer NVENC cards cap
+# concurrent sessions, every encode decodes the source on the CPU, and every
+# encode streams the source in and the output out.
+SLOT_LIMITS = {
+    "encoder": 3,
+    "cpu": os.cpu_count() or 4,
+    "io": 4,
+}
+
+def rung_cost(width, height, bitrate):
+    # Encode time grows with output pixels; bitrate breaks ties between same-size rungs
+    return (width * height, bitrate)
+
+def rung_demand(width, height):
+    # Every rung holds one encoder session and one I/O slot; decoding and
+    # scaling for bigger outputs costs proportionally more CPU
+    return {"encoder": 1, "cpu": max(1, (width * height) // (1920 * 1080)), "io": 1}
+
+class EncodeScheduler:
+    # Runs submitted jobs most expensive first, starting each one only once all
+    # of the slots it needs are free. Cheaper jobs backfill slots a bigger job
+    # can't use yet. One scheduler can be shared by any number of callers.
+
+    def __init__(self, limits=None):
+        self.limits = dict(limits or SLOT_LIMITS)
+        self.in_use = {name: 0 for name in self.limits}
+        self.pending = []
+        self.condition = threading.Condition()
+        self.sequence = 0
+
+    def clamp(self, demand):
+        # A demand above a limit is capped so the job can still run on its own
+        return {name: min(amount, self.limits[name]) for name, amount in demand.items() if name in self.limits}
+
+    def fits(self, demand):
+        return all(self.in_use[name] + amount <= self.limits[name] for name, amount in demand.items())
+
+    def submit(self, cost, demand, fn, *args):
+        future = concurrent.futures.Future()
+        with self.condition:
+            self.sequence += 1
+            self.pending.append(((cost, -self.sequence), self.clamp(demand), future, fn, args))
+            self.pending.sort(key=lambda job: job[0], reverse=True)
+            self.dispatch()
+        return future
+
+    def dispatch(self):
+        # Called with the condition held
+        for job in list(self.pending):
+            _, demand, future, fn, args = job
+            if not self.fits(demand):
+                continue
+            self.pending.remove(job)
+            if not future.set_running_or_notify_cancel():
+                continue
+            for name, amount in demand.items():
+                self.in_use[name] += amount
+            threading.Thread(target=self.run, args=(demand, future, fn, args), daemon=True).start()
+
+    def run(self, demand, future, fn, args):
+        try:
+            future.set_result(fn(*args))
+        except BaseException as exc:
+            future.set_exception(exc)
+        finally:
+            with self.condition:
+                for name, amount in demand.items():
+                    self.in_use[name] -= amount
+                self.dispatch()
+
+def ffmpeg_ladder_command(source_path, outputs):
+    # One decode, split into one scaled branch per output, each with its own
+    # NVENC encoder and AAC stereo track, matching the HandBrake settings
+    labels = [f"v{i}" for i in range(len(outputs))]
+    graph = [f"[0:v]split={len(outputs)}" + "".join(f"[{label}]" for label in labels)]
+    for label, (width, height, _bitrate, _path) in zip(labels, outputs):
+        graph.append(f"[{label}]scale={width}:{height}:force_original_aspect_ratio=decrease:force_divisible_by=2,"
+                     f"format=p010le[{label}out]")
+
+    command = [
+        "ffmpeg", "-hide_banner", "-nostdin", "-y",
+        "-i", str(source_path),
+        "-filter_complex", ";".join(graph),
+    ]
+    for label, (width, height, bitrate, path) in zip(labels, outputs):
+        level = "6.0" if width == 3840 and height == 2160 else "5.1"
+        command += [
+            "-map", f"[{label}out]", "-map", "0:a:0?",
+            "-c:v", "hevc_nvenc", "-profile:v", "main10", "-level:v", level,
+            "-b:v", f"{bitrate}k", "-preset", "p4",
+            "-c:a", "aac", "-ac", "2", "-b:a", "128k",
+            "-f", "matroska", str(path),
+        ]
+    return command
+
+def encode_ladder_ffmpeg(source_path, output_path, rungs, imdb_id, imdb_name, imdb_year, LOGGER):
+    # Decode the source once and encode every rung from that single decode.
+    # Returns False (after cleaning up) if anything went wrong, so the caller
+    # can fall back to per-rung HandBrake encodes.
+    outputs = {}
+    for width, height, bitrate in rungs:
+        file_name = rung_file_name(imdb_id, imdb_name, imdb_year, height)
+        # Rungs sharing a height share a file name; keep the first (highest bitrate) one
+        if file_name in outputs:
+            LogIt(LOGGER, f"⚠️  {width}x{height} @ {bitrate}kbps writes the same file as an earlier rung, skipping it", "warning")
+            continue
+        outputs[file_name] = (width, height, bitrate, output_path / file_name)
+        record_rung(imdb_id, width, height, bitrate, file_name, "running")
+
+    NotifyMe(title="Encode Status", message=f"Started single-pass encode of {len(outputs)} renditions for {imdb_name} …")
+    LogIt(LOGGER, f"Encoding {len(outputs)} renditions from one decode with ffmpeg", "info")
+
+    started = time.monotonic()
+    try:
+        partials = [(width, height, bitrate, partial_output(path)) for width, height, bitrate, path in outputs.values()]
+        OUTPUT = subprocess.run(ffmpeg_ladder_command(source_path, partials),
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, start_new_session=DETACH_CHILDREN)
+        exit_code = OUTPUT.returncode
+        if exit_code != 0:
+            LogIt(LOGGER, f"❌ ffmpeg ladder encode failed with return code {exit_code}", "error")
+            LogIt(LOGGER, f"STDERR:\n{OUTPUT.stderr[-4000:]}", "debug")
+    except Exception as exc:
+        LogIt(LOGGER, f"❌ Exception while running the ffmpeg ladder encode: {exc}", "error")
+        exit_code = None
+
+    # All or nothing: publish every rendition, or discard every partial file
+    # so the fallback and the SRT stage never trip over half-written ones
+    published = [publish_rung(path, exit_code, imdb_id, width, height, bitrate)
+                 for width, height, bitrate, path in outputs.values()]
+    LogEvent(LOGGER, "encode", imdb_id, ",".join(rung_label(height, bitrate) for _, height, bitrate, _ in outputs.values()),
+             time.monotonic() - started, engine="ffmpeg", exit_code=exit_code, ok=all(published))
+    if all(published):
+        LogIt(LOGGER, f"✅ Done: {', '.join(outputs)}", "info")
+        NotifyMe(title="Encode Status", message=f"Single-pass encode for {imdb_name} is complete!")
+        return True
+    for (width, height, bitrate, path), ok in zip(outputs.values(), published):
+        if ok:
+            path.unlink(missing_ok=True)
+            record_rung(imdb_id, width, height, bitrate, path.name, "failed", exit_code)
+    return False
+
+# Whisper model used on a GPU, and the smaller one used when the SRT stage has
+# to run on the CPU and no model was asked for
+WHISPER_MODEL = "large-v3"
+WHISPER_CPU_MODEL = "small"
+
+# Each CPU transcription worker gets this many torch threads
+CPU_THREADS_PER_WORKER = 4
+
+def transcription_devices(device="auto", workers=None):
+    # One worker per GPU by default, or as many CPU workers as the cores allow
+    if device == "auto":
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cuda":
+        gpus = max(torch.cuda.device_count(), 1)
+        return [f"cuda:{i % gpus}" for i in range(workers or gpus)]
+    workers = workers or max(1, (os.cpu_count() or 1) // CPU_THREADS_PER_WORKER)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // workers))
+    return ["cpu"] * workers
+
+class TranscriptionService:
+    # Keeps one warm whisper model per worker and runs transcription jobs on a
+    # pool of that many threads. A model isn't safe to share between
+    # concurrent transcribe calls, so each call checks a replica out of the
+    # pool and puts it back; replicas are loaded the first time they're needed.
+    # Anything that takes a whisper model can be given the service instead.
+    def __init__(self, model_name=None, device="auto", workers=None, precision="fp16"):
+        self.devices = transcription_devices(device, workers)
+        self.on_gpu = self.devices[0].startswith("cuda")
+        self.model_name = model_name or (WHISPER_MODEL if self.on_gpu else WHISPER_CPU_MODEL)
+        # Half precision only works on the GPU
+        self.fp16 = precision == "fp16" and self.on_gpu
+        self.unloaded = list(self.devices)
+        self.models = queue.Queue()
+        self.lock = threading.Lock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.devices), thread_name_prefix="whisper")
+
+    def checkout(self):
+        # A load that fails (CUDA out of memory while NVENC holds the card,
+        # say) hands its device back, and callers waiting on a replica look
+        # again every second, so one of them retries the load rather than
+        # everyone waiting for a model that will never arrive
+        while True:
+            try:
+                return self.models.get_nowait()
+            except queue.Empty:
+                pass
+            with self.lock:
+                device = self.unloaded.pop() if self.unloaded else None
+            if device is None:
+                try:
+                    return self.models.get(timeout=1)
+                except queue.Empty:
+                    continue
+            try:
+                return whisper.load_model(self.model_name, device=device)
+            except Exception:
+                with self.lock:
+                    self.unloaded.append(device)
+                raise
+
+    def transcribe(self, audio, **options):
+        options.setdefault("fp16", self.fp16)
+        model = self.checkout()
+        try:
+            return model.transcribe(audio, **options)
+        finally:
+            self.models.put(model)
+
+    def submit(self, fn, *args):
+        return self.pool.submit(fn, *args)
+
+    def shutdown(self):
+        self.pool.shutdown()
+
 def format_timestamp(seconds):
     hours = int(seconds // 3600)
     minutes = int((seconds % 3600) // 60)
@@ -129,32 +1295,599 @@ def format_timestamp(seconds):
     millis = int((seconds - int(seconds)) * 1000)
     return f"{hours:02}:{minutes:02}:{secs:02},{millis:03}"
 
-def generate_srt(model, file_path, output_dir, LOGGER):
+# Whisper works on 16 kHz mono audio
+AUDIO_SAMPLE_RATE = 16000
+
+# Raw PCM tracks and their transcripts are staged here while a title encodes
+AUDIO_WORK_DIR = '/opt/whisper/audio'
+
+def extract_audio(source_path, imdb_id, LOGGER):
+    # Pull the first audio track out of the source as raw 16 kHz mono s16le,
+    # the format whisper would otherwise decode the whole MKV into itself
+    if not shutil.which("ffmpeg"):
+        LogIt(LOGGER, "⚠️  ffmpeg is not in PATH, transcription will wait for the encodes", "warning")
+        return None
+    os.makedirs(AUDIO_WORK_DIR, exist_ok=True)
+    pcm_path = Path(AUDIO_WORK_DIR) / f"{imdb_id}.pcm"
+    partial = partial_output(pcm_path)
+    command = [
+        "ffmpeg", "-nostdin", "-hide_banner", "-loglevel", "error", "-y",
+        "-i", str(source_path),
+        "-map", "0:a:0", "-vn",
+        "-ac", "1", "-ar", str(AUDIO_SAMPLE_RATE),
+        "-f", "s16le", "-acodec", "pcm_s16le",
+        str(partial)
+    ]
+    started = time.monotonic()
+    OUTPUT = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace", start_new_session=DETACH_CHILDREN)
+    if OUTPUT.returncode != 0 or not partial.exists() or partial.stat().st_size == 0:
+        partial.unlink(missing_ok=True)
+        LogIt(LOGGER, f"⚠️  Audio extraction failed with return code {OUTPUT.returncode}, transcription will wait for the encodes", "warning")
+        LogIt(LOGGER, f"STDERR:\n{OUTPUT.stderr[-4000:]}", "debug")
+        return None
+    os.replace(partial, pcm_path)
+    LogEvent(LOGGER, "extract_audio", imdb_id, None, time.monotonic() - started,
+             audio_seconds=round(pcm_path.stat().st_size / 2 / AUDIO_SAMPLE_RATE, 3))
+    return pcm_path
+
+def load_pcm(pcm_path):
+    # Whisper takes float32 samples in [-1, 1)
+    return np.fromfile(pcm_path, dtype=np.int16).astype(np.float32) / 32768.0
+
+def transcribe_audio(service, audio_future, LOGGER, cancel=None):
+    # Transcription stage of the job pipeline: waits for the extracted track and
+    # transcribes it while the encode ladder is still running. Setting cancel
+    # stops it before the next chunk.
+    pcm_path = audio_future.result()
+    if pcm_path is None:
+        return None
+    try:
+        return generate_srt(service, pcm_path, pcm_path.with_suffix(".srt"), LOGGER, cancel)
+    finally:
+        pcm_path.unlink(missing_ok=True)
+
+def discard_transcript(transcript_future):
+    # Done-callback for a pipeline transcript nobody is going to link
+    try:
+        transcript = transcript_future.result()
+    except Exception:
+        return
+    if transcript:
+        transcript.unlink(missing_ok=True)
+
+TRANSCRIBE_OPTIONS = {
+    "task": "transcribe",
+    "language": "en",
+    "word_timestamps": True,
+    "verbose": False
+}
+
+# Long audio is transcribed in chunks of about this length, each one
+# checkpointed as it finishes; 0 transcribes the whole file in one call
+CHUNK_SECONDS = 600
+
+# Chunk boundaries go at the quietest point within this far of the target
+SILENCE_SEARCH_SECONDS = 30
+
+# Length of the frames whose energy is compared when looking for silence
+SILENCE_FRAME_SECONDS = 0.1
+
+def split_at_silence(audio, chunk_seconds):
+    # Cut the audio into (start, end) sample ranges of roughly chunk_seconds,
+    # each cut placed in the lowest-energy frame near its target so it falls
+    # between words rather than through one
+    chunk = int(chunk_seconds * AUDIO_SAMPLE_RATE)
+    window = int(SILENCE_SEARCH_SECONDS * AUDIO_SAMPLE_RATE)
+    frame = int(SILENCE_FRAME_SECONDS * AUDIO_SAMPLE_RATE)
+    bounds = [0]
+    while len(audio) - bounds[-1] > chunk + window:
+        low = bounds[-1] + chunk - window
+        frames = audio[low:low + 2 * window // frame * frame].reshape(-1, frame)
+        energy = np.square(frames).mean(axis=1)
+        bounds.append(low + int(energy.argmin()) * frame + frame // 2)
+    bounds.append(len(audio))
+    return list(zip(bounds, bounds[1:]))
+
+def checkpoint_path(srt_path):
+    return srt_path.with_name(srt_path.name + ".checkpoint.json")
+
+def load_checkpoint(path, chunks):
+    # Finished chunks from an earlier run, as long as the audio was cut the same way
+    try:
+        checkpoint = json.loads(path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+    if checkpoint.get("chunks") != [list(chunk) for chunk in chunks]:
+        return {}
+    return {int(index): segments for index, segments in checkpoint["done"].items()}
+
+def save_checkpoint(path, chunks, done):
+    partial = partial_output(path)
+    partial.write_text(json.dumps({"chunks": chunks, "done": done}), encoding="utf-8")
+    os.replace(partial, path)
+
+def transcribe_chunked(model, file_path, srt_path, LOGGER, cancel=None):
+    # Transcribe the audio chunk by chunk, saving each chunk's segments (with
+    # timestamps shifted to the whole file) as soon as it is done. A rerun
+    # after a crash only transcribes the chunks missing from the checkpoint.
+    # Chunks run in parallel when the model is a service with several workers.
+    audio = load_pcm(file_path) if file_path.suffix == ".pcm" else whisper.load_audio(str(file_path))
+    chunks = split_at_silence(audio, CHUNK_SECONDS)
+    checkpoint = checkpoint_path(srt_path)
+    done = load_checkpoint(checkpoint, chunks)
+    if done:
+        LogIt(LOGGER, f"⏭️  Resuming {file_path.name}: {len(done)} of {len(chunks)} chunks already transcribed", "info")
+    lock = threading.Lock()
+
+    def transcribe_chunk(index):
+        if cancel is not None and cancel.is_set():
+            raise concurrent.futures.CancelledError(f"transcription of {file_path.name} was cancelled")
+        start, end = chunks[index]
+        offset = start / AUDIO_SAMPLE_RATE
+        result = model.transcribe(audio[start:end], **TRANSCRIBE_OPTIONS)
+        segments = [{"start": segment["start"] + offset, "end": segment["end"] + offset, "text": segment["text"]}
+                    for segment in result["segments"]]
+        with lock:
+            done[index] = segments
+            save_checkpoint(checkpoint, chunks, done)
+
+    remaining = [index for index in range(len(chunks)) if index not in done]
+    workers = len(getattr(model, "devices", [None]))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk") as pool:
+        list(pool.map(transcribe_chunk, remaining))
+    return [segment for index in range(len(chunks)) for segment in done[index]]
+
+def generate_srt(model, file_path, srt_path, LOGGER, cancel=None):
+    if cancel is not None and cancel.is_set():
+        raise concurrent.futures.CancelledError(f"transcription of {file_path.name} was cancelled")
     LogIt(LOGGER, f"🎮️  Transcribing: {file_path.name}", "info")
-    result = model.transcribe(
-        str(file_path),
-        task="transcribe",
-        language="en",
-        word_timestamps=True,
-        verbose=False
-    )
-    srt_path = output_dir / (file_path.stem + ".srt")
-    with open(srt_path, "w", encoding="utf-8") as f:
-        for i, segment in enumerate(result["segments"]):
+    started = time.monotonic()
+    if CHUNK_SECONDS:
+        segments = transcribe_chunked(model, file_path, srt_path, LOGGER, cancel)
+    else:
+        audio = load_pcm(file_path) if file_path.suffix == ".pcm" else str(file_path)
+        segments = model.transcribe(audio, **TRANSCRIBE_OPTIONS)["segments"]
+    # Written under the partial suffix so a crash never leaves a truncated
+    # SRT that a rerun would take as finished
+    partial = partial_output(srt_path)
+    with open(partial, "w", encoding="utf-8") as f:
+        for i, segment in enumerate(segments):
             f.write(f"{i+1}\n")
             f.write(f"{format_timestamp(segment['start'])} --> {format_timestamp(segment['end'])}\n")
             f.write(segment["text"].strip() + "\n\n")
+    os.replace(partial, srt_path)
+    checkpoint_path(srt_path).unlink(missing_ok=True)
     LogIt(LOGGER, f"✅ Saved: {srt_path}", "info")
+    LogEvent(LOGGER, "transcribe", file_path.stem, None, time.monotonic() - started, segments=len(segments))
+    return srt_path
+
+# The part of a rendition's file name that names the rung, e.g. " - 1080p"
+RENDITION_SUFFIX = re.compile(r" - \d+p$")
+
+def group_renditions(files):
+    # Renditions of one title differ only in the rung suffix
+    titles = {}
+    for file in files:
+        titles.setdefault(RENDITION_SUFFIX.sub("", file.stem), []).append(file)
+    return titles
+
+def link_srt(srt_path, target):
+    # Hard link where the filesystem allows it, otherwise copy
+    target.unlink(missing_ok=True)
+    try:
+        os.link(srt_path, target)
+    except OSError:
+        shutil.copyfile(srt_path, target)
+
+def transcribe_title(model, renditions, LOGGER, audio_source=None, transcript=None):
+    # Every rendition of a title carries the same audio, so transcribe it once
+    # (or take the transcript made while encoding) and give each rendition's
+    # .srt name the same subtitles
+    existing = [file.with_suffix(".srt") for file in renditions if file.with_suffix(".srt").exists()]
+    for srt_path in existing:
+        LogIt(LOGGER, f"⚠️  Skipping existing SRT: {srt_path.name}", "info")
+    missing = [file.with_suffix(".srt") for file in renditions if not file.with_suffix(".srt").exists()]
+    try:
+        if not missing:
+            return
+        if existing:
+            srt_path = existing[0]
+        elif transcript:
+            srt_path = transcript
+        else:
+            # The smallest rendition is the least to read through for the same audio
+            audio_source = audio_source or min(renditions, key=lambda file: file.stat().st_size)
+            srt_path = generate_srt(model, audio_source, missing.pop(0), LOGGER)
+        for target in missing:
+            link_srt(srt_path, target)
+            LogIt(LOGGER, f"🔗 Linked {target.name} to {srt_path.name}", "info")
+    finally:
+        # The staged transcript has been linked into place, or isn't needed
+        if transcript:
+            transcript.unlink(missing_ok=True)
+
+def transcription_service(args, LOGGER):
+    service = TranscriptionService(args.whisper_model, args.whisper_device, args.transcribe_workers, args.precision)
+    LogIt(LOGGER, f"🧠 Transcribing with {service.model_name} on {', '.join(service.devices)} ({'fp16' if service.fp16 else 'fp32'})", "info")
+    return service
+
+def process_title(args, ladder, source_path, imdb_id, dest_path, scheduler, service, verifier, metadata=None):
+    # Encode, verify and (with --makesrt) transcribe one title. The scheduler,
+    # transcription service and verification pool may be shared with other
+    # titles running at the same time; metadata is an already-submitted
+    # resolve_imdb future, if any. Returns a summary for batch reporting.
+    result = {"imdb_id": imdb_id, "source": source_path.name, "ok": False, "renditions": 0,
+              "source_seconds": 0.0, "encode_seconds": 0.0}
+    try:
+        job_started = time.monotonic()
+        name, year = metadata.result() if metadata else resolve_imdb(imdb_id)
+    except Exception as e:
+        LogIt("bootstrap.log", f"❌ IMDb metadata fetch failed for {imdb_id}: {e}", "critical")
+        return result
+
+    safe_name = ''.join(c if c.isalnum() or c == '_' else '_' for c in name.replace(' ', '_').lower())
+    LOGGER = f"{safe_name}.log"
+    LogIt(LOGGER, f"🎬 Job started for {name} ({year}) [IMDB {imdb_id}]", "info")
+    LogEvent(LOGGER, "metadata", imdb_id, None, time.monotonic() - job_started, name=name, year=year)
+
+    folder_name = f"{name} ({year}) {{imdb-{imdb_id}}}"
+    final_output_path = dest_path / folder_name
+    final_output_path.mkdir(parents=True, exist_ok=True)
+    record_title(imdb_id, "encoding", name, year, source_path, final_output_path)
+
+    # Anything still carrying the partial suffix was cut off by a crash
+    for stale in final_output_path.glob(f"*{PARTIAL_SUFFIX}"):
+        LogIt(LOGGER, f"🧹 Removing interrupted encode: {stale.name}", "info")
+        stale.unlink()
+
+    # With --makesrt the audio is pulled out of the source now and transcribed
+    # alongside the encodes, so the title takes max(encode, transcribe)
+    if args.makesrt:
+        pipeline = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix="pipeline")
+        audio_future = pipeline.submit(extract_audio, source_path, imdb_id, LOGGER)
+        cancel_transcript = threading.Event()
+        transcript_future = pipeline.submit(transcribe_audio, service, audio_future, LOGGER, cancel_transcript)
+        pipeline.shutdown(wait=False)
+
+    # Fit the ladder to the source: no upscaled rungs, and bitrates tuned to
+    # how hard the title is to encode when a complexity sample was asked for
+    probe_started = time.monotonic()
+    probe = probe_source(source_path)
+    complexity = 1.0
+    if probe is None:
+        LogIt(LOGGER, "⚠️  Could not probe the source, encoding the full ladder", "warning")
+    else:
+        if args.complexity_sample and shutil.which("ffmpeg"):
+            complexity = sample_complexity(source_path, probe)
+        LogIt(LOGGER, f"🔎 Source is {probe['width']}x{probe['height']} @ {probe['fps']} fps, "
+                      f"{'HDR' if probe['hdr'] else 'SDR'}, {probe['duration'] / 60:.1f} min, complexity {complexity}", "info")
+        result["source_seconds"] = probe["duration"]
+        LogEvent(LOGGER, "probe", imdb_id, None, time.monotonic() - probe_started, width=probe["width"], height=probe["height"],
+                 fps=probe["fps"], hdr=probe["hdr"], source_seconds=probe["duration"], complexity=complexity)
+
+    # Rungs that share a height would write (and race on) the same file name,
+    # so only the first, highest-bitrate one of each is encoded
+    rungs = {}
+    for width, height, bitrate in plan_ladder(ladder, probe, complexity):
+        rungs.setdefault(rung_file_name(imdb_id, name, year, height), (width, height, bitrate))
+    rungs = list(rungs.values())
+    expected = list(rungs)
+    encode_started = time.monotonic()
+
+    # Every rung is verified as soon as it is published, while the rest encode
+    verifications = {}
+    def verify(rung):
+        output = final_output_path / rung_file_name(imdb_id, name, year, rung[1])
+        verifications[rung] = verifier.submit(verify_rung, output, probe, imdb_id, *rung, LOGGER,
+                                              inspect=args.encoder_backend != "stub")
+
+    # Rungs a previous run already finished don't need encoding again
+    done = [rung for rung in rungs
+            if rung_is_done(imdb_id, *rung, final_output_path / rung_file_name(imdb_id, name, year, rung[1]))]
+    if done:
+        LogIt(LOGGER, f"⏭️  Resuming: {len(done)} of {len(rungs)} rungs already encoded", "info")
+    rungs = [rung for rung in rungs if rung not in done]
+    for rung in done:
+        verify(rung)
+
+    if args.engine == "ffmpeg" and rungs:
+        # A pass is one process holding an encoder session per output, so a
+        # ladder with more rungs than encoder slots is split into passes of at
+        # most that many outputs, each decoding the source once
+        group_size = scheduler.limits["encoder"]
+        ordered = sorted(rungs, key=lambda rung: rung_cost(*rung), reverse=True)
+        passes = {}
+        for start in range(0, len(ordered), group_size):
+            group = ordered[start:start + group_size]
+            demand = {"encoder": len(group), "cpu": sum(rung_demand(w, h)["cpu"] for w, h, _ in group), "io": 1}
+            passes[scheduler.submit(max(rung_cost(*rung) for rung in group), demand, encode_ladder_ffmpeg,
+                                    source_path, final_output_path, group, imdb_id, name, year, LOGGER)] = group
+        rungs = []
+        for single_pass, group in passes.items():
+            if single_pass.result():
+                for rung in group:
+                    verify(rung)
+            else:
+                rungs += group
+        if rungs:
+            LogIt(LOGGER, f"↩️  Falling back to per-rung HandBrake encodes for {len(rungs)} rungs", "warning")
+
+    # Biggest rungs first, never more at once than the slot limits allow
+    encoder = ENCODER_BACKENDS[args.encoder_backend]
+    futures = {}
+    for width, height, bitrate in rungs:
+        demand = rung_demand(width, height)
+        if encoder is segmented_encode_rung and SEGMENT_TRANSPORT.runs_locally and height >= SEGMENT_MIN_HEIGHT:
+            # Its segments run as that many encoder sessions on this machine
+            demand["encoder"] = SEGMENT_TRANSPORT.workers
+        futures[scheduler.submit(
+            rung_cost(width, height, bitrate), demand,
+            encoder, source_path, final_output_path,
+            width, height, bitrate, imdb_id, name, year, LOGGER
+        )] = (width, height, bitrate)
+
+    for future in concurrent.futures.as_completed(futures):
+        try:
+            if future.result():
+                verify(futures[future])
+        except Exception as e:
+            LogIt(LOGGER, f"Unhandled exception in encoding task: {e}", "critical")
+
+    # Rungs that couldn't be checked still count as encoded, but only
+    # verified ones let the source go
+    verified = unverified = 0
+    for rung, verification in verifications.items():
+        try:
+            outcome = verification.result()
+        except Exception as e:
+            LogIt(LOGGER, f"Unhandled exception while verifying {rung_label(rung[1], rung[2])}: {e}", "critical")
+            continue
+        if outcome is None:
+            unverified += 1
+        elif outcome:
+            verified += 1
+    success_count = verified + unverified
+    result["renditions"] = success_count
+    result["encode_seconds"] = time.monotonic() - encode_started
+    if encoder is segmented_encode_rung:
+        discard_segments(source_path)
+
+    if args.makesrt:
+        # The source can't go until the audio has been read out of it
+        concurrent.futures.wait([audio_future])
+
+    if success_count == 0 or not any(final_output_path.glob("*.mkv")):
+        record_title(imdb_id, "failed")
+        LogIt(LOGGER, "❌ No successful MKV encodes found. Aborting SRT stage.", "critical")
+        if args.makesrt:
+            # Stop transcribing audio nothing will use; a chunk checkpoint
+            # already written is kept for the rerun
+            cancel_transcript.set()
+            transcript_future.add_done_callback(discard_transcript)
+        LogEvent(LOGGER, "job", imdb_id, None, time.monotonic() - job_started, renditions=0, ok=False)
+        return result
+    complete = verified == len(expected)
+    record_title(imdb_id, "encoded" if complete else "incomplete")
+    LogEvent(LOGGER, "ladder", imdb_id, None, time.monotonic() - job_started, renditions=success_count,
+             verified=verified, expected=len(expected))
+
+    LogIt(LOGGER, f"🏁 {success_count} of {len(expected)} renditions completed, {verified} verified.", "info")
+
+    # The source only goes once every rung it was meant to produce has verified
+    if not complete:
+        LogIt(LOGGER, f"⚠️  Keeping source file {source_path.name}: {len(expected) - verified} renditions did not verify", "warning")
+    elif source_path.exists() and source_path.is_file():
+        try:
+            source_path.unlink()
+            LogIt(LOGGER, f"🗑️  Deleted source file: {source_path.name}", "info")
+        except Exception as e:
+            LogIt(LOGGER, f"❌ Failed to delete source file {source_path.name}: {e}", "error")
+
+    if args.makesrt:
+        LogIt(LOGGER, "🎙️  Generating SRT subtitles...", "info")
+        try:
+            transcript = transcript_future.result()
+        except Exception as e:
+            LogIt(LOGGER, f"❌ Transcription alongside the encodes failed: {e}", "error")
+            transcript = None
+        renditions = sorted(final_output_path.glob("*.mkv"))
+        if transcript:
+            transcribe_title(None, renditions, LOGGER, transcript=transcript)
+        else:
+            transcribe_title(service, renditions, LOGGER)
+
+    LogEvent(LOGGER, "job", imdb_id, None, time.monotonic() - job_started, renditions=success_count, ok=complete)
+    result["ok"] = complete
+    return result
+
+# Titles worked on at once in batch mode; all of their rungs share one scheduler
+BATCH_TITLES = 3
+
+# Watch mode looks for new sources this often, and takes a file once its size
+# hasn't changed between two looks
+WATCH_INTERVAL = 60
+
+IMDB_ID = re.compile(r"tt\d{7,}")
+
+def read_manifest(path, LOGGER):
+    # One "<imdb id> <source path>" per line; blank lines and # comments are
+    # skipped, malformed lines are logged and skipped. Relative source paths
+    # are relative to the manifest, not to wherever the batch was started.
+    titles = []
+    base = Path(path).resolve().parent
+    with open(path, encoding="utf-8") as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            fields = line.split(None, 1)
+            if len(fields) != 2 or not re.fullmatch(r'tt\d{7,9}', fields[0]):
+                LogIt(LOGGER, f"⚠️  Skipping line {number} of {path}: expected \"<imdb id> <source path>\", got {line!r}", "warning")
+                continue
+            imdb_id, source = fields
+            titles.append(((base / source).resolve(), imdb_id))
+    return titles
+
+def watch_sources(directory, seen, sizes, busy, LOGGER):
+    # Sources in the watch directory that have finished arriving; the IMDb ID
+    # comes from the file name, e.g. "The Thing (1982) {imdb-tt0084787}.mkv".
+    # A source whose ID is in busy (a title in progress shares its output
+    # folder, job rows and staged audio) waits until that title is done.
+    ready = []
+    for path in sorted(directory.glob("*.mkv")):
+        if path in seen:
+            continue
+        match = IMDB_ID.search(path.name)
+        if not match:
+            LogIt(LOGGER, f"⚠️  Ignoring {path.name}: no IMDb ID in the file name", "warning")
+            seen.add(path)
+            continue
+        try:
+            size = path.stat().st_size
+        except OSError:
+            # Gone (or renamed) since the glob
+            sizes.pop(path, None)
+            continue
+        if sizes.get(path) == size and match.group() in busy:
+            LogIt(LOGGER, f"⏳ Holding {path.name}: {match.group()} is already in progress", "debug")
+        elif sizes.get(path) == size:
+            ready.append((path, match.group()))
+            busy.add(match.group())
+            seen.add(path)
+        sizes[path] = size
+    return ready
+
+def report_throughput(results, elapsed, LOGGER):
+    finished = [result for result in results if result["ok"]]
+    source_minutes = sum(result["source_seconds"] for result in finished) / 60
+    encode_minutes = sum(result["encode_seconds"] for result in finished) / 60
+    titles_per_hour = len(finished) * 3600 / elapsed if elapsed else 0.0
+    encode_ratio = encode_minutes / source_minutes if source_minutes else 0.0
+    wall_ratio = elapsed / 60 / source_minutes if source_minutes else 0.0
+    LogIt(LOGGER, f"📊 {len(finished)} of {len(results)} titles done in {elapsed / 60:.1f} min: "
+                  f"{titles_per_hour:.2f} titles/hour, {encode_ratio:.2f} encode minutes per source minute "
+                  f"({wall_ratio:.2f} wall-clock minutes per source minute overall)", "info")
+    LogEvent(LOGGER, "batch", None, None, elapsed, titles=len(results), completed=len(finished),
+             titles_per_hour=round(titles_per_hour, 3), source_minutes=round(source_minutes, 2),
+             encode_minutes_per_source_minute=round(encode_ratio, 3), wall_minutes_per_source_minute=round(wall_ratio, 3))
+
+def run_batch(args, ladder, dest_path, LOGGER):
+    # Every title's rungs go through one scheduler, its transcription through
+    # one service and its verification through one pool, so titles overlap
+    # without ever exceeding the box-wide limits
+    scheduler = EncodeScheduler({"encoder": args.encoder_slots, "cpu": args.cpu_slots, "io": args.io_slots})
+    service = transcription_service(args, LOGGER) if args.makesrt else None
+    verifier = concurrent.futures.ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="verify")
+    titles = concurrent.futures.ThreadPoolExecutor(max_workers=args.batch_titles, thread_name_prefix="title")
+    lookups = concurrent.futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="imdb")
+    futures = {}
+    results = []
+    started = time.monotonic()
+
+    def submit(source_path, imdb_id):
+        # Resolve the metadata now, while earlier titles are still encoding;
+        # the title waits on this lookup rather than starting its own
+        metadata = lookups.submit(resolve_imdb, imdb_id)
+        LogIt(LOGGER, f"📥 Queued {source_path.name} [IMDB {imdb_id}]", "info")
+        futures[titles.submit(process_title, args, ladder, source_path, imdb_id, dest_path,
+                              scheduler, service, verifier, metadata)] = (source_path, imdb_id)
+
+    def collect(future):
+        source_path, imdb_id = futures.pop(future)
+        try:
+            results.append(future.result())
+        except Exception as e:
+            LogIt(LOGGER, f"❌ Unhandled exception processing {source_path.name}: {e}", "critical")
+            results.append({"ok": False, "source_seconds": 0.0, "encode_seconds": 0.0})
+
+    if args.manifest:
+        queued = set()
+        for source_path, imdb_id in read_manifest(args.manifest, LOGGER):
+            if not source_path.is_file():
+                LogIt(LOGGER, f"⚠️  Skipping {source_path}: source file does not exist", "warning")
+            elif imdb_id in queued:
+                LogIt(LOGGER, f"⚠️  Skipping {source_path}: {imdb_id} is already queued", "warning")
+            else:
+                queued.add(imdb_id)
+                submit(source_path, imdb_id)
+        for future in concurrent.futures.as_completed(list(futures)):
+            collect(future)
+    else:
+        watch_path = Path(args.watch).resolve()
+        LogIt(LOGGER, f"👀 Watching {watch_path} for new sources", "info")
+        seen, sizes = set(), {}
+        try:
+            while True:
+                busy = {imdb_id for _, imdb_id in futures.values()}
+                for source_path, imdb_id in watch_sources(watch_path, seen, sizes, busy, LOGGER):
+                    submit(source_path, imdb_id)
+                finished = [future for future in futures if future.done()]
+                for future in finished:
+                    collect(future)
+                if finished:
+                    report_throughput(results, time.monotonic() - started, LOGGER)
+                time.sleep(args.interval)
+        except KeyboardInterrupt:
+            LogIt(LOGGER, f"🛑 Stopped watching, finishing {len(futures)} titles in progress", "info")
+            for future in concurrent.futures.as_completed(list(futures)):
+                collect(future)
+
+    titles.shutdown()
+    lookups.shutdown()
+    verifier.shutdown()
+    if service:
+        service.shutdown()
+    report_throughput(results, time.monotonic() - started, LOGGER)
 
 def main():
+    global JOB_DB_PATH, IMDB_CACHE_PATH, IMDB_CACHE_TTL, IMDB_OFFLINE, IMDB_BASE_URL, METRICS_PATH, CHUNK_SECONDS
+    global SEGMENT_COUNT, SEGMENT_MIN_HEIGHT, SEGMENT_TRANSPORT, DETACH_CHILDREN
     parser = argparse.ArgumentParser(description="Encode MKV in multiple resolutions and optionally generate SRT.")
     parser.add_argument("--source", help="Path to source MKV file (optional if only generating SRTs)")
     parser.add_argument("--dest", required=True, help="Destination folder for output or SRTs")
     parser.add_argument("--imdb", help="IMDB ID for the movie (e.g., tt1234567)")
     parser.add_argument("--makesrt", action="store_true", help="Generate SRT subtitles")
     parser.add_argument("--verbose", action="store_true", help="Enable verbose (DEBUG-level) logging")
+    parser.add_argument("--offline", action="store_true", help="Resolve IMDB IDs from the local cache only")
+    parser.add_argument("--imdb-cache", default=IMDB_CACHE_PATH, help="SQLite cache of resolved IMDB titles")
+    parser.add_argument("--imdb-ttl-days", type=float, default=IMDB_CACHE_TTL / 86400, help="Days a cached IMDB title is trusted")
+    parser.add_argument("--imdb-url", default=IMDB_BASE_URL, help="Base URL for IMDB title pages")
+    parser.add_argument("--jobs-db", default=JOB_DB_PATH, help="SQLite job store used to resume interrupted titles")
+    parser.add_argument("--metrics", default=METRICS_PATH, help="Live rung progress export: a Prometheus textfile, or JSON if it ends in .json (empty to disable)")
+    parser.add_argument("--whisper-model", help=f"Whisper model for the SRT stage (default {WHISPER_MODEL} on a GPU, {WHISPER_CPU_MODEL} on the CPU)")
+    parser.add_argument("--whisper-device", choices=["auto", "cuda", "cpu"], default="auto", help="Device for the SRT stage; auto uses the GPU when there is one")
+    parser.add_argument("--transcribe-workers", type=int, help="Concurrent transcriptions, each with its own copy of the model (default one per GPU, or one per few CPU cores)")
+    parser.add_argument("--precision", choices=["fp16", "fp32"], default="fp16", help="Whisper precision on the GPU; the CPU always uses fp32")
+    parser.add_argument("--chunk-minutes", type=float, default=CHUNK_SECONDS / 60, help="Transcribe in checkpointed chunks of about this length so an interrupted run resumes (0 for one pass)")
+    parser.add_argument("--ladder", help="JSON file of [\"WIDTHxHEIGHT\", kbps] pairs to use instead of the built-in ladder")
+    parser.add_argument("--complexity-sample", action="store_true", help="Scale the ladder's bitrates by a quick sample encode of the source")
+    parser.add_argument("--manifest", help="Batch mode: file of \"<imdb id> <source path>\" lines to encode")
+    parser.add_argument("--watch", help="Batch mode: directory to watch for sources with an IMDB ID in the file name")
+    parser.add_argument("--batch-titles", type=int, default=BATCH_TITLES, help="Titles worked on at once in batch mode")
+    parser.add_argument("--interval", type=float, default=WATCH_INTERVAL, help="Seconds between looks at the watch directory")
+    parser.add_argument("--engine", choices=["handbrake", "ffmpeg"], default="handbrake", help="ffmpeg decodes the source once per group of up to --encoder-slots rungs, falling back to HandBrake per rung on failure")
+    parser.add_argument("--encoder-backend", choices=sorted(ENCODER_BACKENDS), default="handbrake", help="Encoder used for each rung (stub simulates encodes for testing)")
+    parser.add_argument("--segments", type=int, default=SEGMENT_COUNT, help="Segmented backend: pieces each big rung is split into")
+    parser.add_argument("--segment-min-height", type=int, default=SEGMENT_MIN_HEIGHT, help="Segmented backend: smaller rungs are encoded whole")
+    parser.add_argument("--segment-transport", choices=sorted(SEGMENT_TRANSPORTS), default="local", help="Segmented backend: where segments are encoded (loopback stands in for ssh locally)")
+    parser.add_argument("--segment-nodes", default="", help="Segmented backend: comma-separated ssh hosts, or scratch directories for loopback")
+    parser.add_argument("--segment-workers", type=int, default=SEGMENT_WORKERS, help="Segmented backend: concurrent segment encodes, per node for remote transports")
+    parser.add_argument("--encoder-slots", type=int, default=SLOT_LIMITS["encoder"], help="Concurrent hardware encoder sessions")
+    parser.add_argument("--cpu-slots", type=int, default=SLOT_LIMITS["cpu"], help="CPU cores shared by the running encodes")
+    parser.add_argument("--io-slots", type=int, default=SLOT_LIMITS["io"], help="Encodes allowed to stream from/to disk at once")
     args = parser.parse_args()
 
+    JOB_DB_PATH = args.jobs_db
+    IMDB_CACHE_PATH = args.imdb_cache
+    IMDB_CACHE_TTL = args.imdb_ttl_days * 86400
+    IMDB_OFFLINE = args.offline
+    IMDB_BASE_URL = args.imdb_url.rstrip("/")
+    METRICS_PATH = args.metrics
+    CHUNK_SECONDS = args.chunk_minutes * 60
+    SEGMENT_COUNT = args.segments
+    SEGMENT_MIN_HEIGHT = args.segment_min_height
+    DETACH_CHILDREN = bool(args.watch)
+
     bootstrap_logger = "bootstrap.log"
     LogIt(bootstrap_logger, f"⚙️  Launch args: {vars(args)}", "info")
 
@@ -164,7 +1897,7 @@ def main():
         return
 
     # SRT-only mode if no source or imdb provided
-    if args.makesrt and args.source is None and args.imdb is None:
+    if args.makesrt and args.source is None and args.imdb is None and not (args.manifest or args.watch):
         LOGGER = dest_path.name.lower().replace(" ", "_") + ".log"
         LogIt(LOGGER, f"🔁 SRT-only mode started on: {dest_path}", "info")
 
@@ -173,97 +1906,82 @@ def main():
             LogIt(LOGGER, "❌ No MKV files found in destination for SRT generation.", "error")
             return
 
-        LogIt(LOGGER, f"🎤 Generating SRT subtitles for {len(mkvs)} MKV files...", "info")
-        model = whisper.load_model("large-v3", device="cuda")
+        titles = group_renditions(mkvs)
+        LogIt(LOGGER, f"🎤 Generating SRT subtitles for {len(titles)} titles ({len(mkvs)} MKV files)...", "info")
+        service = transcription_service(args, LOGGER)
 
-        for file in mkvs:
-            srt_path = file.with_suffix(".srt")
-            if srt_path.exists():
-                LogIt(LOGGER, f"⚠️  Skipping existing SRT: {srt_path.name}", "info")
-                continue
-            generate_srt(model, file, dest_path, LOGGER)
+        futures = {service.submit(transcribe_title, service, renditions, LOGGER): title
+                   for title, renditions in titles.items()}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                future.result()
+            except Exception as e:
+                LogIt(LOGGER, f"❌ Transcription failed for {futures[future]}: {e}", "error")
+        service.shutdown()
 
         LogIt(LOGGER, "✅ SRT-only generation complete.", "info")
         return
 
-    # Full encode + optional SRT
-    source_path = Path(args.source).resolve()
-    if not source_path.is_file():
-        print(f"❌ Source file does not exist: {source_path}")
+    # Full encode + optional SRT, for one title or a batch of them
+    batch = args.manifest or args.watch
+    if batch and (args.source or args.imdb):
+        print("❌ --source and --imdb can't be combined with --manifest or --watch.")
         return
 
-    if not shutil.which("HandBrakeCLI"):
-        print("❌ HandBrakeCLI is not installed or not in PATH.")
-        return
-
-    try:
-        imdb_id = validate_imdb_id(args.imdb)
-        name = imdb_name(imdb_id)
-        year = imdb_year(imdb_id)
-    except Exception as e:
-        LogIt(bootstrap_logger, f"❌ IMDb metadata fetch failed: {e}", "critical")
+    if args.watch and not Path(args.watch).is_dir():
+        print(f"❌ Watch directory does not exist: {args.watch}")
         return
 
-    safe_name = ''.join(c if c.isalnum() or c == '_' else '_' for c in name.replace(' ', '_').lower())
-    LOGGER = f"{safe_name}.log"
-    LogIt(LOGGER, f"🎬 Job started for {name} ({year}) [IMDB {imdb_id}]", "info")
-
-    folder_name = f"{name} ({year}) {{imdb-{imdb_id}}}"
-    final_output_path = dest_path / folder_name
-    final_output_path.mkdir(parents=True, exist_ok=True)
+    if not batch:
+        source_path = Path(args.source).resolve()
+        if not source_path.is_file():
+            print(f"❌ Source file does not exist: {source_path}")
+            return
 
-    ladder = [
-        ("3840x2160", 25000),
-        ("1920x1080", 5800),
-        ("1920x1080", 4300),
-        ("1280x720", 3500),
-        ("1280x720", 2750),
-        ("720x404", 1750),
-        ("720x404", 1100),
-        ("512x288", 700),
-        ("384x216", 400)
-    ]
+    if args.encoder_backend in ("handbrake", "segmented") and not shutil.which("HandBrakeCLI"):
+        print("❌ HandBrakeCLI is not installed or not in PATH.")
+        return
 
-    success_count = 0
-    with concurrent.futures.ThreadPoolExecutor(max_workers=len(ladder)) as executor:
-        futures = []
-        for res, bitrate in ladder:
-            width, height = map(int, res.split("x"))
-            futures.append(executor.submit(
-                encode_rung, source_path, final_output_path,
-                width, height, bitrate, imdb_id, name, year, LOGGER
-            ))
+    if args.encoder_backend != "stub" and not shutil.which("ffprobe"):
+        print("⚠️  ffprobe is not installed or not in PATH: renditions are kept unverified and sources are not deleted.")
 
-        for future in concurrent.futures.as_completed(futures):
-            try:
-                if future.result():
-                    success_count += 1
-            except Exception as e:
-                LogIt(LOGGER, f"Unhandled exception in encoding task: {e}", "critical")
+    if args.encoder_backend == "segmented":
+        if not shutil.which("ffmpeg"):
+            print("❌ ffmpeg is not installed or not in PATH.")
+            return
+        try:
+            nodes = [node.strip() for node in args.segment_nodes.split(",") if node.strip()]
+            SEGMENT_TRANSPORT = SEGMENT_TRANSPORTS[args.segment_transport](args.segment_workers, nodes)
+        except ValueError as e:
+            print(f"❌ Could not set up the {args.segment_transport} segment transport: {e}")
+            return
+        if SEGMENT_TRANSPORT.runs_locally and SEGMENT_TRANSPORT.workers > args.encoder_slots:
+            # Each segmented rung is charged all of its workers as encoder sessions
+            print(f"❌ The {args.segment_transport} segment transport runs {SEGMENT_TRANSPORT.workers} HandBrakeCLI "
+                  f"sessions here, more than --encoder-slots {args.encoder_slots}; lower --segment-workers")
+            return
 
-    if success_count == 0 or not any(final_output_path.glob("*.mkv")):
-        LogIt(LOGGER, "❌ No successful MKV encodes found. Aborting SRT stage.", "critical")
+    if args.engine == "ffmpeg" and not shutil.which("ffmpeg"):
+        print("❌ ffmpeg is not installed or not in PATH.")
         return
 
-    LogIt(LOGGER, f"🏁 {success_count} renditions completed successfully.", "info")
+    try:
+        ladder = load_ladder(args.ladder)
+    except (OSError, ValueError, TypeError, IndexError) as e:
+        print(f"❌ Could not read the ladder file {args.ladder}: {e}")
+        return
 
-    # Delete the source MKV file if it exists
-    if source_path.exists() and source_path.is_file() and success_count > 0:
-        try:
-            source_path.unlink()
-            LogIt(LOGGER, f"🗑️  Deleted source file: {source_path.name}", "info")
-        except Exception as e:
-            LogIt(LOGGER, f"❌ Failed to delete source file {source_path.name}: {e}", "error")
+    if args.manifest or args.watch:
+        run_batch(args, ladder, dest_path, "batch.log")
+        return
 
-    if args.makesrt:
-        LogIt(LOGGER, "🎙️  Generating SRT subtitles...", "info")
-        model = whisper.load_model("large-v3", device="cuda")
-        for file in sorted(final_output_path.glob("*.mkv")):
-            srt_path = file.with_suffix(".srt")
-            if not srt_path.exists():
-                generate_srt(model, file, final_output_path, LOGGER)
-            else:
-                LogIt(LOGGER, f"⚠️  Skipping existing SRT: {srt_path.name}", "info")
+    scheduler = EncodeScheduler({"encoder": args.encoder_slots, "cpu": args.cpu_slots, "io": args.io_slots})
+    service = transcription_service(args, bootstrap_logger) if args.makesrt else None
+    verifier = concurrent.futures.ThreadPoolExecutor(max_workers=VERIFY_WORKERS, thread_name_prefix="verify")
+    process_title(args, ladder, source_path, args.imdb, dest_path, scheduler, service, verifier)
+    verifier.shutdown()
+    if service:
+        service.shutdown()
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
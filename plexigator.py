@@ -1,61 +1,917 @@
 import os
+import re
+import json
+import time
+import select
+import struct
 import sqlite3
+import argparse
+import ctypes
+import ctypes.util
+import heapq
+import hashlib
+import unicodedata
+from datetime import datetime
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import quote
 
 # Path to the Plex SQLite database
 PLEX_DB_PATH = '/opt/projects/plexigator/database/databaseBackup.db'
 
+# The database Plex Media Server is running against; only ever read through
+# snapshot_plex_db() so Plex is never held up by our queries
+PLEX_LIVE_DB_PATH = ('/var/lib/plexmediaserver/Library/Application Support/Plex Media Server/'
+                     'Plug-in Support/Databases/com.plexapp.plugins.library.db')
+
 # Directory containing your TV shows
 TV_SHOWS_DIR = '/opt/media/tv.shows'
 
-def get_plex_tv_shows(db_path):
-    # Connect to the Plex database
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+# Number of rows pulled from SQLite per fetchmany() call
+FETCH_BATCH_SIZE = 5000
+
+# Read-only tuning for the scan connection (mmap in bytes, page cache in KiB)
+MMAP_SIZE = 256 * 1024 * 1024
+CACHE_SIZE_KIB = 64 * 1024
+
+def open_plex_db(db_path, immutable=True, mmap_size=MMAP_SIZE, cache_size_kib=CACHE_SIZE_KIB):
+    # Open the database read-only through a URI so we never take a lock on it.
+    # immutable=1 also skips locking and change detection, which is only safe
+    # for a copy of the database that nothing else is writing to.
+    uri = f"file:{quote(os.path.abspath(db_path))}?mode=ro"
+    if immutable:
+        uri += "&immutable=1"
+    conn = sqlite3.connect(uri, uri=True)
+
+    # Tune the connection for one big sequential read
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = -{int(cache_size_kib)}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    conn.execute("PRAGMA query_only = ON")
+    return conn
+
+# Pages copied per backup step, and the pause between steps that lets Plex get
+# its locks back
+SNAPSHOT_PAGES_PER_STEP = 256
+SNAPSHOT_STEP_SLEEP = 0.05
+
+def source_signature(db_path):
+    # The header change counter (bytes 24-27) moves on every commit to the main
+    # file; commits still sitting in the WAL only show up on the -wal file
+    with open(db_path, 'rb') as f:
+        header = f.read(100)
+    signature = [struct.unpack('>I', header[24:28])[0]]
+    try:
+        st = os.stat(db_path + '-wal')
+        signature += [st.st_mtime_ns, st.st_size]
+    except FileNotFoundError:
+        signature += [None, None]
+    return signature
+
+def snapshot_plex_db(live_path, snapshot_path, pages=SNAPSHOT_PAGES_PER_STEP, sleep=SNAPSHOT_STEP_SLEEP):
+    # Copy the live database with the online backup API, a few pages at a time,
+    # unless it hasn't changed since the last snapshot. Returns True on a copy.
+    meta_path = f'{snapshot_path}.json'
+    signature = source_signature(live_path)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+    except (FileNotFoundError, ValueError):
+        previous = None
+    if previous == {'source': live_path, 'signature': signature} and os.path.exists(snapshot_path):
+        return False
+
+    tmp_path = f'{snapshot_path}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    source = sqlite3.connect(f"file:{quote(os.path.abspath(live_path))}?mode=ro", uri=True)
+    target = sqlite3.connect(tmp_path)
+    try:
+        source.backup(target, pages=pages, sleep=sleep)
+        # Plex runs in WAL mode; the snapshot is a plain file that can be opened immutable
+        target.execute('PRAGMA journal_mode = DELETE')
+    finally:
+        target.close()
+        source.close()
+    os.replace(tmp_path, snapshot_path)
 
-    # Execute a query to get the list of file paths from the media_parts table
-    cursor.execute('''
-        SELECT file
+    # Record the signature from before the copy, so anything written while we
+    # were copying triggers a fresh snapshot next time
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump({'source': live_path, 'signature': signature}, f)
+    return True
+
+def prefix_range(prefix):
+    # Turn '/some/dir' into the half-open range ['/some/dir/', '/some/dir0').
+    # Unlike LIKE, a range predicate can be answered from the index on file.
+    low = prefix.rstrip('/') + '/'
+    high = low[:-1] + chr(ord('/') + 1)
+    return low, high
+
+def iter_plex_files(conn, prefix, batch_size=FETCH_BATCH_SIZE, with_size=False):
+    # Stream file paths (or (file, size) pairs) under prefix in fetchmany()
+    # batches instead of fetchall(). Without size the index alone answers it.
+    low, high = prefix_range(prefix)
+    cursor = conn.execute(f'''
+        SELECT file{', size' if with_size else ''}
         FROM media_parts
-        WHERE file LIKE '/opt/media/tv.shows/%'
-    ''')
+        WHERE file >= ? AND file < ?
+    ''', (low, high))
 
-    # Fetch all results and extract folder names and their full paths
-    plex_tv_shows = {}
-    for row in cursor.fetchall():
-        file_path = row[0]
-        folder_path = os.path.dirname(file_path)
-        folder_name = os.path.basename(folder_path)
-        plex_tv_shows[folder_name] = folder_path
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        if with_size:
+            yield from rows
+        else:
+            for row in rows:
+                yield row[0]
 
-    # Close the connection
-    conn.close()
+def show_folder(file_path, root):
+    # First folder below root, e.g. 'Show' for root/Show/Season 01/episode.mkv
+    return file_path[len(root) + 1:].split('/', 1)[0]
+
+def get_plex_tv_shows(db_path, root=TV_SHOWS_DIR, batch_size=FETCH_BATCH_SIZE):
+    # Connect to the Plex database
+    conn = open_plex_db(db_path)
+
+    # Stream the file paths and extract show folder names and their full paths
+    root = root.rstrip('/')
+    plex_tv_shows = {}
+    try:
+        for file_path in iter_plex_files(conn, root, batch_size):
+            folder_name = show_folder(file_path, root)
+            plex_tv_shows[folder_name] = os.path.join(root, folder_name)
+    finally:
+        # Close the connection
+        conn.close()
 
     return plex_tv_shows
 
+# Plex library_sections.section_type values
+SECTION_TYPES = {1: 'movies', 2: 'tv', 8: 'music', 13: 'photos'}
+
+def get_library_sections(db_path):
+    # Every library root Plex knows about -> (section name, section type)
+    conn = open_plex_db(db_path)
+    try:
+        rows = conn.execute('''
+            SELECT sl.root_path, ls.name, ls.section_type
+            FROM section_locations sl
+            JOIN library_sections ls ON ls.id = sl.library_section_id
+        ''').fetchall()
+    finally:
+        conn.close()
+    return {root_path.rstrip('/'): (name, SECTION_TYPES.get(section_type, str(section_type)))
+            for root_path, name, section_type in rows}
+
+def values_list(rows):
+    # Placeholders and flat parameters for a VALUES list of equal-width rows
+    placeholders = ', '.join(['(' + ', '.join(['?'] * len(rows[0])) + ')'] * len(rows))
+    return placeholders, [value for row in rows for value in row]
+
+def get_plex_libraries(db_path, roots):
+    # One pass over media_parts for every root: each root becomes its own index
+    # range, and SQLite groups the parts down to one row per top-level folder
+    # so only the folder list crosses into Python. Section names come from
+    # get_library_sections(), so parts are never joined back to their section.
+    libraries = {root: {} for root in roots}
+    if not roots:
+        return libraries
+
+    placeholders, params = values_list([(root,) + prefix_range(root) for root in roots])
+    conn = open_plex_db(db_path)
+    try:
+        cursor = conn.execute(f'''
+            WITH roots (root, low, high) AS (VALUES {placeholders}),
+            parts AS (
+                SELECT roots.root AS root,
+                       substr(mp.file, length(roots.low) + 1) AS rel
+                FROM roots
+                JOIN media_parts mp ON mp.file >= roots.low AND mp.file < roots.high
+            )
+            SELECT DISTINCT root,
+                   CASE WHEN instr(rel, '/') > 0 THEN substr(rel, 1, instr(rel, '/') - 1) ELSE rel END AS folder
+            FROM parts
+        ''', params)
+
+        while True:
+            rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+            if not rows:
+                break
+            for root, folder in rows:
+                libraries[root][folder] = os.path.join(root, folder)
+    finally:
+        conn.close()
+    return libraries
+
+# One entry per file or folder found on disk
+IndexEntry = namedtuple('IndexEntry', 'name path size mtime_ns inode dev is_dir')
+
+# Threads used to walk top-level folders in parallel (mostly waiting on NFS/SMB)
+SCAN_WORKERS = 16
+
+def make_entry(entry, is_dir, follow_symlinks=False, stat=True):
+    # os.scandir() already knows the inode; size, mtime and device cost one
+    # stat, so stat=False leaves them out for entries nothing reads them from.
+    # A stat'ed entry takes its inode from the stat too, so it always pairs
+    # with st_dev (they differ from the scandir inode for symlinks).
+    if not stat:
+        return IndexEntry(entry.name, entry.path, 0, None, entry.inode(), None, is_dir)
+    st = entry.stat(follow_symlinks=follow_symlinks)
+    return IndexEntry(entry.name, entry.path, 0 if is_dir else st.st_size, st.st_mtime_ns, st.st_ino, st.st_dev, is_dir)
+
+def scan_tree(top):
+    # Walk everything below top without following symlinks, using the cached
+    # d_type from os.scandir() to tell files from folders. Only files are
+    # stat'ed: their size and mtime feed the file reports and duplicate
+    # search, while nested folders are only ever descended into.
+    entries = []
+    pending = [top]
+    while pending:
+        try:
+            listing = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with listing:
+            for entry in listing:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        entries.append(make_entry(entry, True, stat=False))
+                        pending.append(entry.path)
+                    elif entry.is_file():
+                        entries.append(make_entry(entry, False, follow_symlinks=True))
+                except OSError:
+                    continue
+    return entries
+
+def scan_top_level(root):
+    # List root itself; top-level folders may be symlinks, like os.path.isdir() allowed
+    entries = []
+    with os.scandir(root) as listing:
+        for entry in listing:
+            try:
+                is_dir = entry.is_dir()
+                if is_dir or entry.is_file():
+                    entries.append(make_entry(entry, is_dir, follow_symlinks=True))
+            except OSError:
+                continue
+    return entries
+
+def scan_libraries(roots, recursive=True, workers=SCAN_WORKERS):
+    # Build one index for every root, fanning each top-level folder out to the pool
+    index = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for root, top_level in zip(roots, executor.map(scan_top_level, roots)):
+            index[root] = top_level
+        if recursive:
+            jobs = [(root, executor.submit(scan_tree, entry.path))
+                    for root in roots for entry in index[root] if entry.is_dir]
+            for root, job in jobs:
+                index[root].extend(job.result())
+    return index
+
+# Files Plex would pick up; artwork, .nfo and .srt files on disk are ignored
+MEDIA_EXTENSIONS = {
+    '.mkv', '.mp4', '.m4v', '.avi', '.mov', '.ts', '.m2ts', '.wmv', '.mpg', '.mpeg', '.webm', '.flv',
+    '.mp3', '.flac', '.m4a', '.aac', '.ogg', '.opus', '.wav',
+}
+
+def is_media_file(name):
+    return os.path.splitext(name)[1].lower() in MEDIA_EXTENSIONS
+
+def index_folders(entries, root):
+    # Top-level names for a root: folders, plus media files sitting loose in it
+    return {entry.name for entry in entries
+            if (entry.is_dir or is_media_file(entry.name)) and os.path.dirname(entry.path) == root}
+
 def get_local_tv_shows(directory):
     # Get the list of directories in the TV shows directory
-    return {name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name))}
+    return index_folders(scan_libraries([directory], recursive=False)[directory], directory)
 
-def main():
-    # Get Plex TV shows list
-    plex_tv_shows = get_plex_tv_shows(PLEX_DB_PATH)
-    
-    # Get local TV shows list
-    local_tv_shows = get_local_tv_shows(TV_SHOWS_DIR)
+SEASON_FOLDER = re.compile(r'^(?:season|series)[ ._-]*(\d+)$', re.IGNORECASE)
+EPISODE_TAG = re.compile(r'\b[Ss](\d{1,4})[ ._-]*[Ee](\d{1,4})|\b(\d{1,2})x(\d{2,3})\b')
+
+def index_files(entries, root):
+    # Path below root -> size for every media file in the index
+    return {entry.path[len(root) + 1:]: entry.size for entry in entries
+            if not entry.is_dir and is_media_file(entry.name)}
+
+def get_plex_files(db_path, root, batch_size=FETCH_BATCH_SIZE):
+    # Path below root -> size straight from the Plex database
+    conn = open_plex_db(db_path)
+    try:
+        return {file_path[len(root) + 1:]: size
+                for file_path, size in iter_plex_files(conn, root, batch_size, with_size=True)}
+    finally:
+        conn.close()
+
+def parse_episode(relative_path):
+    # Split 'Show/Season 01/Show - S01E02.mkv' into ('Show', 1, 2); parts that
+    # can't be worked out are None. The SxxEyy tag wins over the folder name.
+    parts = relative_path.split('/')
+    season = episode = None
+    for part in parts[1:-1]:
+        match = SEASON_FOLDER.match(part)
+        if match:
+            season = int(match.group(1))
+        elif part.lower() == 'specials':
+            season = 0
+
+    match = EPISODE_TAG.search(parts[-1])
+    if match:
+        tag_season, tag_episode = match.group(1, 2) if match.group(1) else match.group(3, 4)
+        season, episode = int(tag_season), int(tag_episode)
+    return parts[0], season, episode
+
+def reconcile_files(plex_files, disk_files):
+    # Both sides map a path below root to a size, so every check is a set/dict lookup
+    return {
+        'missing': plex_files.keys() - disk_files.keys(),
+        'unindexed': disk_files.keys() - plex_files.keys(),
+        'size_mismatch': {path for path in plex_files.keys() & disk_files.keys()
+                          if plex_files[path] is not None and plex_files[path] != disk_files[path]},
+    }
+
+def episode_label(relative_path):
+    show, season, episode = parse_episode(relative_path)
+    if season is not None and episode is not None:
+        return f"{show} S{season:02}E{episode:02}"
+    if season is not None:
+        return f"{show} Season {season}"
+    return show
+
+def episode_sort_key(relative_path):
+    show, season, episode = parse_episode(relative_path)
+    return show, -1 if season is None else season, -1 if episode is None else episode, relative_path
+
+# Where the last reconciled state is kept between runs
+STATE_DB_PATH = '/opt/projects/plexigator/database/plexigator_state.db'
+
+# Ids per "WHERE id IN (...)" lookup, kept under SQLite's variable limit
+ID_LOOKUP_CHUNK = 500
+
+def open_state_db(state_path):
+    # Open (or create) the local state store
+    state = sqlite3.connect(state_path)
+
+    # Digests cached before the device was part of the key can't be told
+    # apart across mounts; it's only a cache, so start it over
+    columns = {row[1] for row in state.execute('PRAGMA table_info(file_hashes)')}
+    if columns and 'dev' not in columns:
+        state.execute('DROP TABLE file_hashes')
+    state.executescript('''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value
+        );
+        CREATE TABLE IF NOT EXISTS plex_parts (
+            id INTEGER PRIMARY KEY,
+            file TEXT NOT NULL,
+            size INTEGER,
+            updated_at
+        );
+        CREATE INDEX IF NOT EXISTS plex_parts_file ON plex_parts (file);
+        CREATE TABLE IF NOT EXISTS local_dirs (
+            path TEXT PRIMARY KEY,
+            root TEXT NOT NULL,
+            name TEXT NOT NULL,
+            mtime_ns INTEGER,
+            inode INTEGER
+        );
+        CREATE TABLE IF NOT EXISTS last_diff (
+            root TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (root, kind, name)
+        );
+        CREATE TABLE IF NOT EXISTS file_hashes (
+            dev INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            partial TEXT,
+            full TEXT,
+            PRIMARY KEY (dev, inode, size, mtime_ns)
+        );
+    ''')
+
+    # State stores created before sizes were tracked need the column added
+    columns = {row[1] for row in state.execute('PRAGMA table_info(plex_parts)')}
+    if 'size' not in columns:
+        state.execute('ALTER TABLE plex_parts ADD COLUMN size INTEGER')
+        state.execute("DELETE FROM meta WHERE key LIKE 'plex_watermark:%'")
+        state.commit()
+    return state
+
+def get_meta(state, key, default=None):
+    row = state.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+    return row[0] if row else default
+
+def set_meta(state, key, value):
+    state.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+def reset_state(state, root):
+    # Forget everything we know about root so the next sync starts from scratch
+    low, high = prefix_range(root)
+    state.execute('DELETE FROM plex_parts WHERE file >= ? AND file < ?', (low, high))
+    state.execute('DELETE FROM local_dirs WHERE root = ?', (root,))
+    state.execute('DELETE FROM meta WHERE key IN (?, ?)', (f'plex_watermark:{root}', f'root_mtime:{root}'))
+    state.commit()
+
+def fetch_parts_by_id(conn, ids):
+    # Look up full rows for a set of ids, a chunk at a time
+    ids = sorted(ids)
+    for start in range(0, len(ids), ID_LOOKUP_CHUNK):
+        chunk = ids[start:start + ID_LOOKUP_CHUNK]
+        placeholders = ','.join('?' * len(chunk))
+        yield from conn.execute(f'SELECT id, file, size, updated_at FROM media_parts WHERE id IN ({placeholders})', chunk)
+
+def sync_plex_parts(state, db_path, root, batch_size=FETCH_BATCH_SIZE, immutable=True):
+    # Bring the stored copy of media_parts under root up to date and return what changed
+    return sync_plex_roots(state, db_path, [root], batch_size, immutable)[root]
+
+def sync_plex_roots(state, db_path, roots, batch_size=FETCH_BATCH_SIZE, immutable=True):
+    # The same for several roots at once: each root is one row of a VALUES
+    # list (its index range, and its watermark once it has one), so every step
+    # is a single statement however many roots there are. Returns root -> changes.
+    ranges = {root: prefix_range(root) for root in roots}
+    watermarks = {root: get_meta(state, f'plex_watermark:{root}') for root in roots}
+    known = {root: dict(state.execute('SELECT id, file FROM plex_parts WHERE file >= ? AND file < ?', ranges[root]))
+             for root in roots}
+    changes = {root: {'added': [], 'removed': [], 'moved': []} for root in roots}
+    newest = dict(watermarks)
+    current_ids = {root: set() for root in roots}
+    first_run = [root for root in roots if watermarks[root] is None or not known[root]]
+    incremental = [root for root in roots if root not in first_run]
+
+    def apply(root, part_id, file_path, size, updated_at):
+        current_ids[root].add(part_id)
+        old_path = known[root].get(part_id)
+        if old_path is None:
+            changes[root]['added'].append(file_path)
+        elif old_path != file_path:
+            changes[root]['moved'].append((old_path, file_path))
+        if updated_at is not None and (newest[root] is None or updated_at > newest[root]):
+            newest[root] = updated_at
+        state.execute('INSERT OR REPLACE INTO plex_parts (id, file, size, updated_at) VALUES (?, ?, ?, ?)',
+                      (part_id, file_path, size, updated_at))
+
+    conn = open_plex_db(db_path, immutable=immutable)
+    try:
+        if first_run:
+            # First run: stream every row under these roots
+            placeholders, params = values_list([(root,) + ranges[root] for root in first_run])
+            cursor = conn.execute(f'''
+                WITH roots (root, low, high) AS (VALUES {placeholders})
+                SELECT roots.root, mp.id, mp.file, mp.size, mp.updated_at
+                FROM roots
+                JOIN media_parts mp ON mp.file >= roots.low AND mp.file < roots.high
+            ''', params)
+            for batch in iter(lambda: cursor.fetchmany(batch_size), []):
+                for row in batch:
+                    apply(*row)
+
+        if incremental:
+            # Ids are answered from the file index alone, so this never touches the table
+            placeholders, params = values_list([(root,) + ranges[root] for root in incremental])
+            for root, part_id in conn.execute(f'''
+                WITH roots (root, low, high) AS (VALUES {placeholders})
+                SELECT roots.root, mp.id
+                FROM roots
+                JOIN media_parts mp ON mp.file >= roots.low AND mp.file < roots.high
+            ''', params):
+                current_ids[root].add(part_id)
+
+            # Rows touched since each root's watermark, plus any ids we have never seen.
+            # >= re-reads rows stamped in the same tick as the watermark, which
+            # is harmless and avoids missing writes that landed right after it.
+            placeholders, params = values_list([(root,) + ranges[root] + (watermarks[root],) for root in incremental])
+            changed = conn.execute(f'''
+                WITH roots (root, low, high, watermark) AS (VALUES {placeholders})
+                SELECT roots.root, mp.id, mp.file, mp.size, mp.updated_at
+                FROM roots
+                JOIN media_parts mp ON mp.file >= roots.low AND mp.file < roots.high AND mp.updated_at >= roots.watermark
+            ''', params).fetchall()
+            unseen = {root: current_ids[root] - known[root].keys() for root in incremental}
+            for row in changed:
+                unseen[row[0]].discard(row[1])
+            for part_id, file_path, size, updated_at in fetch_parts_by_id(conn, set().union(*unseen.values())):
+                changed += [(root, part_id, file_path, size, updated_at) for root in incremental if part_id in unseen[root]]
+            for row in changed:
+                apply(*row)
+    finally:
+        conn.close()
+
+    # Anything we knew about that is no longer under root was removed (or
+    # moved out); a part that moved to another of these roots keeps its row
+    everywhere = set().union(*current_ids.values())
+    for root in roots:
+        for part_id in known[root].keys() - current_ids[root]:
+            changes[root]['removed'].append(known[root][part_id])
+            if part_id not in everywhere:
+                state.execute('DELETE FROM plex_parts WHERE id = ?', (part_id,))
+        if newest[root] is not None:
+            set_meta(state, f'plex_watermark:{root}', newest[root])
+    state.commit()
+    return changes
+
+def sync_local_dirs(state, root):
+    # Re-list root only when its mtime moved, and return the folders that came and went
+    root_mtime = os.stat(root).st_mtime_ns
+    mtime_key = f'root_mtime:{root}'
+    changes = {'added': [], 'removed': []}
+    if get_meta(state, mtime_key) == root_mtime:
+        return changes
+
+    known = {row[0]: row[1:] for row in state.execute(
+        'SELECT path, mtime_ns, inode FROM local_dirs WHERE root = ?', (root,))}
+    seen = set()
+    for entry in scan_libraries([root], recursive=False)[root]:
+        if not entry.is_dir and not is_media_file(entry.name):
+            continue
+        seen.add(entry.path)
+        current = (entry.mtime_ns, entry.inode)
+        previous = known.get(entry.path)
+        if previous is None:
+            changes['added'].append(entry.name)
+        if previous != current:
+            state.execute('''
+                INSERT OR REPLACE INTO local_dirs (path, root, name, mtime_ns, inode)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (entry.path, root, entry.name) + current)
+
+    for path in known.keys() - seen:
+        changes['removed'].append(os.path.basename(path))
+        state.execute('DELETE FROM local_dirs WHERE path = ?', (path,))
+
+    set_meta(state, mtime_key, root_mtime)
+    state.commit()
+    return changes
+
+def load_plex_tv_shows(state, root):
+    # Build the folder map from the stored rows instead of the Plex database
+    low, high = prefix_range(root)
+    plex_tv_shows = {}
+    for (file_path,) in state.execute('SELECT file FROM plex_parts WHERE file >= ? AND file < ?', (low, high)):
+        folder_name = show_folder(file_path, root)
+        plex_tv_shows[folder_name] = os.path.join(root, folder_name)
+    return plex_tv_shows
+
+def load_plex_files(state, root):
+    # Path below root -> size for every stored row
+    low, high = prefix_range(root)
+    return dict(state.execute('SELECT substr(file, ?), size FROM plex_parts WHERE file >= ? AND file < ?',
+                              (len(low) + 1, low, high)))
 
-    # Find the differences
-    plex_tv_show_names = set(plex_tv_shows.keys())
-    not_in_plex = local_tv_shows - plex_tv_show_names
-    not_in_local = plex_tv_show_names - local_tv_shows
+def load_local_tv_shows(state, root):
+    return {row[0] for row in state.execute('SELECT name FROM local_dirs WHERE root = ?', (root,))}
 
+def diff_since_last_run(state, root, not_in_plex, not_in_local):
+    # Compare this run's discrepancies with the ones stored last time, then store these
+    current = {('not_in_plex', name) for name in not_in_plex} | {('not_in_local', name) for name in not_in_local}
+    previous = set(state.execute('SELECT kind, name FROM last_diff WHERE root = ?', (root,)))
+    state.execute('DELETE FROM last_diff WHERE root = ?', (root,))
+    state.executemany('INSERT INTO last_diff (root, kind, name) VALUES (?, ?, ?)',
+                      [(root, kind, name) for kind, name in current])
+    state.commit()
+    return current - previous, previous - current
+
+# Bytes hashed from each end of a file before deciding a full hash is needed
+PARTIAL_HASH_BYTES = 1024 * 1024
+
+# Read size for full hashes
+HASH_CHUNK_BYTES = 8 * 1024 * 1024
+
+# Processes used for hashing
+HASH_WORKERS = os.cpu_count() or 4
+
+def hash_file(job):
+    # Runs in a worker process: ('partial' | 'full', path, size) -> (path, digest)
+    kind, path, size = job
+    digest = hashlib.blake2b(digest_size=20)
+    try:
+        with open(path, 'rb') as f:
+            if kind == 'partial':
+                digest.update(f.read(PARTIAL_HASH_BYTES))
+                if size > 2 * PARTIAL_HASH_BYTES:
+                    f.seek(-PARTIAL_HASH_BYTES, os.SEEK_END)
+                digest.update(f.read(PARTIAL_HASH_BYTES))
+            else:
+                for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b''):
+                    digest.update(chunk)
+    except OSError:
+        return path, None
+    return path, digest.hexdigest()
+
+def group_by(entries, key):
+    groups = {}
+    for entry in entries:
+        groups.setdefault(key(entry), []).append(entry)
+    return [group for group in groups.values() if len(group) > 1]
+
+def find_duplicates(entries, state=None, workers=HASH_WORKERS):
+    # Group media files by size, then by a head/tail hash, then by a full hash,
+    # only hashing what is still colliding at each step. With a state store,
+    # digests are cached by (device, inode, size, mtime) so unchanged files are never re-read.
+    # The cache only ever holds files in the current index: rows for files
+    # that were deleted or changed since are dropped, and only digests
+    # computed in this run are written back.
+
+    # Hard links share a device and inode and aren't duplicates, so keep one
+    # path per file; roots on different mounts can reuse inode numbers
+    files = {}
+    for entry in entries:
+        if not entry.is_dir and entry.size > 0 and is_media_file(entry.name):
+            files.setdefault((entry.dev, entry.inode, entry.size), entry)
+
+    def cache_key(entry):
+        return entry.dev, entry.inode, entry.size, entry.mtime_ns
+
+    cache = {}
+    computed = set()
+    if state is not None:
+        current = {cache_key(entry) for entry in files.values()}
+        stale = []
+        for row in state.execute('SELECT dev, inode, size, mtime_ns, partial, full FROM file_hashes'):
+            if row[:4] in current:
+                cache[row[:4]] = list(row[4:])
+            else:
+                stale.append(row[:4])
+        state.executemany('DELETE FROM file_hashes WHERE dev = ? AND inode = ? AND size = ? AND mtime_ns = ?', stale)
+
+    def fill(kind, candidates, executor):
+        slot = 0 if kind == 'partial' else 1
+        todo = {entry.path: entry for entry in candidates
+                if cache.get(cache_key(entry), [None, None])[slot] is None}
+        jobs = [(kind, entry.path, entry.size) for entry in todo.values()]
+        for path, digest in executor.map(hash_file, jobs, chunksize=16):
+            cache.setdefault(cache_key(todo[path]), [None, None])[slot] = digest
+            computed.add(cache_key(todo[path]))
+        return [entry for entry in candidates if cache[cache_key(entry)][slot] is not None]
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        same_size = [entry for group in group_by(files.values(), lambda e: e.size) for entry in group]
+        hashed = fill('partial', same_size, executor)
+        same_partial = group_by(hashed, lambda e: (e.size, cache[cache_key(e)][0]))
+
+        # A file no bigger than both ends was hashed whole by the partial pass
+        for entry in (entry for group in same_partial for entry in group):
+            if entry.size <= 2 * PARTIAL_HASH_BYTES and cache[cache_key(entry)][1] is None:
+                cache[cache_key(entry)][1] = cache[cache_key(entry)][0]
+                computed.add(cache_key(entry))
+        hashed = fill('full', [entry for group in same_partial for entry in group], executor)
+
+    if state is not None:
+        state.executemany('INSERT OR REPLACE INTO file_hashes (dev, inode, size, mtime_ns, partial, full) VALUES (?, ?, ?, ?, ?, ?)',
+                          [key + tuple(cache[key]) for key in computed])
+        state.commit()
+
+    groups = group_by(hashed, lambda e: (e.size, cache[cache_key(e)][1]))
+    return sorted(sorted(entry.path for entry in group) for group in groups)
+
+# Where watch mode publishes the current discrepancy list
+STATUS_PATH = '/opt/projects/plexigator/status.json'
+
+# How often watch mode polls the Plex database and re-checks the roots
+WATCH_POLL_SECONDS = 30
+
+# inotify flags from <sys/inotify.h>
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+INOTIFY_EVENT = struct.Struct('iIII')
+
+def inotify_open(paths):
+    # Watch each path for folders being created, removed or renamed
+    libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_DELETE_SELF | IN_MOVE_SELF
+    watches = {}
+    for path in paths:
+        wd = libc.inotify_add_watch(fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            os.close(fd)
+            raise OSError(errno, f'inotify_add_watch failed for {path}')
+        watches[wd] = path
+    return fd, watches
+
+def read_inotify_events(fd):
+    # Drain whatever is queued and yield (wd, mask, name) for each event
+    try:
+        data = os.read(fd, 64 * 1024)
+    except BlockingIOError:
+        return
+    offset = 0
+    while offset < len(data):
+        wd, mask, _cookie, length = INOTIFY_EVENT.unpack_from(data, offset)
+        offset += INOTIFY_EVENT.size
+        name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+        offset += length
+        yield wd, mask, name
+
+def plex_db_signature(db_path):
+    # Any write by Plex moves the mtime or size of the database or its WAL
+    signature = []
+    for path in (db_path, db_path + '-wal'):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            signature.append(None)
+    return tuple(signature)
+
+def load_live_root(state, root):
+    # In-memory view of one root that watch mode keeps up to date
+    plex_tv_shows = load_plex_tv_shows(state, root)
+    local_tv_shows = load_local_tv_shows(state, root)
+    return {
+        'plex': plex_tv_shows,
+        'local': local_tv_shows,
+        'not_in_plex': local_tv_shows - plex_tv_shows.keys(),
+        'not_in_local': plex_tv_shows.keys() - local_tv_shows,
+    }
+
+def folder_added(live, name):
+    live['local'].add(name)
+    live['not_in_local'].discard(name)
+    if name not in live['plex']:
+        live['not_in_plex'].add(name)
+
+def folder_removed(live, name):
+    live['local'].discard(name)
+    live['not_in_plex'].discard(name)
+    if name in live['plex']:
+        live['not_in_local'].add(name)
+
+def write_status(status_path, live_roots):
+    # Write the JSON status file atomically so readers never see half of it
+    status = {
+        'updated_at': datetime.now().isoformat(timespec='seconds'),
+        'roots': {
+            root: {
+                'not_in_plex': sorted(live['not_in_plex']),
+                'not_in_local': {name: live['plex'][name] for name in sorted(live['not_in_local'])},
+            }
+            for root, live in live_roots.items()
+        },
+    }
+    tmp_path = f'{status_path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(status, f, indent=2)
+    os.replace(tmp_path, status_path)
+
+def watch(state, db_path, roots, status_path=STATUS_PATH, interval=WATCH_POLL_SECONDS, live_db=None):
+    # Keep the discrepancy list live: inotify for the folders, polling for Plex.
+    # With live_db, db_path is a snapshot refreshed whenever the live one changes.
+    immutable = live_db is not None
+    live_roots = {}
+    sync_plex_roots(state, db_path, roots, immutable=immutable)
+    for root in roots:
+        sync_local_dirs(state, root)
+        live_roots[root] = load_live_root(state, root)
+    write_status(status_path, live_roots)
+    print(f"Watching {', '.join(roots)}; status in {status_path}")
+
+    fd, watches = inotify_open(roots)
+    signature = plex_db_signature(live_db or db_path)
+    last_poll = time.monotonic()
+    try:
+        while True:
+            ready, _, _ = select.select([fd], [], [], interval)
+            dirty = False
+            resync = set()
+
+            if ready:
+                for wd, mask, name in read_inotify_events(fd):
+                    root = watches.get(wd)
+                    if mask & IN_Q_OVERFLOW:
+                        # Events were dropped, fall back to re-listing every root
+                        resync.update(roots)
+                    elif mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+                        print(f"{root} went away, stopping watch mode")
+                        return
+                    elif root is not None and (mask & IN_ISDIR or is_media_file(name)):
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            folder_added(live_roots[root], name)
+                        else:
+                            folder_removed(live_roots[root], name)
+                        dirty = True
+
+            if time.monotonic() - last_poll >= interval:
+                last_poll = time.monotonic()
+
+                # inotify does not see changes made on other NFS/SMB clients,
+                # so also look at the root mtimes, which costs one stat each
+                resync.update(root for root in roots if any(sync_local_dirs(state, root).values()))
+
+                current = plex_db_signature(live_db or db_path)
+                if current != signature:
+                    signature = current
+                    if live_db:
+                        snapshot_plex_db(live_db, db_path)
+                    plex_changes = sync_plex_roots(state, db_path, roots, immutable=immutable)
+                    resync.update(root for root in roots if any(plex_changes[root].values()))
+
+            for root in resync:
+                sync_local_dirs(state, root)
+                live_roots[root] = load_live_root(state, root)
+                dirty = True
+
+            if dirty:
+                write_status(status_path, live_roots)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        os.close(fd)
+
+# How many likely renames to suggest per unrecognized folder
+SUGGESTION_COUNT = 3
+
+# Candidates scoring below this are not worth printing
+SUGGESTION_MIN_SCORE = 0.4
+
+YEAR_SUFFIX = re.compile(r'[ ._-]*[(\[]?(?:19|20)\d{2}[)\]]?$')
+NON_WORD = re.compile(r'[\W_]+')
+
+def normalize_name(name):
+    # Fold unicode, case, punctuation, a trailing year and the position of
+    # 'The' so 'The Office (US) (2005)' and 'Office (US), The' compare equal
+    name = unicodedata.normalize('NFKD', name)
+    name = ''.join(c for c in name if not unicodedata.combining(c)).casefold()
+    name = name.replace('&', ' and ').replace("'", '').replace('\u2019', '').strip()
+    # A title that is only a year ('1883', '2012') keeps it
+    return ' '.join(name_words(YEAR_SUFFIX.sub('', name)) or name_words(name))
+
+def name_words(name):
+    words = NON_WORD.sub(' ', name).split()
+    if words and words[0] == 'the':
+        words = words[1:]
+    elif len(words) > 1 and words[-1] == 'the':
+        words = words[:-1]
+    return words
+
+def trigrams(normalized):
+    padded = f"  {normalized} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def build_name_index(names):
+    # Inverted index from trigram to the names containing it, so a lookup only
+    # scores names that share at least one trigram with the query
+    names = sorted(names)
+    grams = [trigrams(normalize_name(name)) for name in names]
+    postings = {}
+    for position, name_grams in enumerate(grams):
+        for gram in name_grams:
+            postings.setdefault(gram, []).append(position)
+    return {'names': names, 'grams': grams, 'postings': postings}
+
+def suggest_matches(name_index, name, count=SUGGESTION_COUNT, min_score=SUGGESTION_MIN_SCORE):
+    # Top candidates for name as (candidate, Dice similarity) pairs
+    query = trigrams(normalize_name(name))
+    shared = Counter()
+    for gram in query:
+        shared.update(name_index['postings'].get(gram, ()))
+
+    scored = []
+    for position, overlap in shared.items():
+        score = 2 * overlap / (len(query) + len(name_index['grams'][position]))
+        if score >= min_score:
+            scored.append((score, name_index['names'][position]))
+    return [(candidate, score) for score, candidate in heapq.nlargest(count, scored)]
+
+def print_changes(plex_changes, dir_changes, new_issues, resolved_issues):
+    print("Changes since last run:")
+    print(f"  Plex: {len(plex_changes['added'])} added, {len(plex_changes['removed'])} removed, "
+          f"{len(plex_changes['moved'])} moved")
+    print(f"  Folders: {len(dir_changes['added'])} added, {len(dir_changes['removed'])} removed")
+    for kind, name in sorted(new_issues):
+        print(f"  + [{kind}] {name}")
+    for kind, name in sorted(resolved_issues):
+        print(f"  - [{kind}] {name}")
+    print()
+
+def print_report(plex_tv_shows, not_in_plex, not_in_local, suggestions=None):
     # Print results
     if not_in_plex:
         print("Folders not recognized by Plex:")
         for show in sorted(not_in_plex):
             print(show)
+            for candidate, score in (suggestions or {}).get(show, []):
+                print(f"    maybe: {candidate} ({score:.2f})")
     else:
         print("All local folders are recognized by Plex.")
-    
+
     if not_in_local:
         print("\nTV shows in Plex but not in local folders:")
         for show in sorted(not_in_local):
@@ -63,5 +919,140 @@ def main():
     else:
         print("\nAll Plex TV shows are present in local folders.")
 
+def print_file_report(result, plex_files, disk_files, kinds=('missing', 'unindexed', 'size_mismatch')):
+    headings = {
+        'missing': "Episodes in Plex but missing on disk",
+        'unindexed': "Files on disk not indexed by Plex",
+        'size_mismatch': "Files whose size differs from Plex",
+    }
+    for kind in kinds:
+        heading = headings[kind]
+        paths = sorted(result[kind], key=episode_sort_key)
+        if not paths:
+            print(f"\n{heading}: none")
+            continue
+        print(f"\n{heading} ({len(paths)}):")
+        for path in paths:
+            if kind == 'size_mismatch':
+                print(f"{episode_label(path)}: {path} (Plex {plex_files[path]} bytes, disk {disk_files[path]} bytes)")
+            else:
+                print(f"{episode_label(path)}: {path}")
+
+def print_duplicate_report(groups):
+    if not groups:
+        print("\nNo duplicate media files found.")
+        return
+    print(f"\nDuplicate media files ({len(groups)} groups):")
+    for group in groups:
+        size = os.path.getsize(group[0])
+        print(f"{len(group)} copies, {size} bytes each:")
+        for path in group:
+            print(f"    {path}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the Plex library with the TV shows on disk.")
+    parser.add_argument("--db", default=PLEX_DB_PATH, help="Path to the Plex SQLite database (the snapshot, with --live-db)")
+    parser.add_argument("--live-db", nargs="?", const=PLEX_LIVE_DB_PATH, help=f"Snapshot this live Plex database into --db first (default: {PLEX_LIVE_DB_PATH})")
+    parser.add_argument("--root", action="append", help=f"Library folder to check, may be repeated (default: {TV_SHOWS_DIR})")
+    parser.add_argument("--all-libraries", action="store_true", help="Check every library folder Plex knows about that exists here")
+    parser.add_argument("--state", default=STATE_DB_PATH, help="Where to keep the state between runs")
+    parser.add_argument("--full", action="store_true", help="Discard the saved state and rebuild it from scratch")
+    parser.add_argument("--no-state", action="store_true", help="Do a one-off full scan without reading or writing state")
+    parser.add_argument("--suggest", type=int, default=SUGGESTION_COUNT, help="Likely Plex matches to list per unrecognized folder (0 to disable)")
+    parser.add_argument("--files", action="store_true", help="Also reconcile individual episode files, not just show folders")
+    parser.add_argument("--dupes", action="store_true", help="Report duplicate media files and files no media_parts row references")
+    parser.add_argument("--hash-workers", type=int, default=HASH_WORKERS, help="Processes used to hash files for --dupes")
+    parser.add_argument("--watch", action="store_true", help="Keep running and keep the status file up to date")
+    parser.add_argument("--status", default=STATUS_PATH, help="JSON status file written in watch mode")
+    parser.add_argument("--interval", type=float, default=WATCH_POLL_SECONDS, help="Seconds between Plex database polls in watch mode")
+    args = parser.parse_args()
+    roots = [root.rstrip('/') for root in args.root or []]
+
+    # Refresh the snapshot from the live database, unless it hasn't changed
+    if args.live_db:
+        if snapshot_plex_db(args.live_db, args.db):
+            print(f"Snapshot of {args.live_db} refreshed")
+
+    sections = get_library_sections(args.db)
+    if args.all_libraries:
+        roots += [root for root in sorted(sections) if root not in roots and os.path.isdir(root)]
+    if not roots:
+        roots = [TV_SHOWS_DIR]
+
+    if args.watch:
+        if args.no_state:
+            parser.error("--watch needs the state store, drop --no-state")
+        state = open_state_db(args.state)
+        try:
+            watch(state, args.db, roots, args.status, args.interval, args.live_db)
+        finally:
+            state.close()
+        return
+
+    if args.no_state or args.files or args.dupes:
+        # Scan every root at once, down to the files when they are needed
+        index = scan_libraries(roots, recursive=args.files or args.dupes)
+    if args.no_state:
+        # Every library in a single query
+        libraries = get_plex_libraries(args.db, roots)
+    else:
+        # Only pull what changed since the last run, for every library at once
+        state = open_state_db(args.state)
+        if args.full:
+            for root in roots:
+                reset_state(state, root)
+        plex_changes = sync_plex_roots(state, args.db, roots)
+
+    for root in roots:
+        if len(roots) > 1:
+            name, section_type = sections.get(root, ('not a Plex library', None))
+            print(f"=== {root} ({name}{f', {section_type}' if section_type else ''}) ===")
+
+        if args.no_state:
+            # Get Plex TV shows list
+            plex_tv_shows = libraries[root]
+
+            # Get local TV shows list
+            local_tv_shows = index_folders(index[root], root)
+        else:
+            dir_changes = sync_local_dirs(state, root)
+            plex_tv_shows = load_plex_tv_shows(state, root)
+            local_tv_shows = load_local_tv_shows(state, root)
+
+        # Find the differences
+        plex_tv_show_names = set(plex_tv_shows.keys())
+        not_in_plex = local_tv_shows - plex_tv_show_names
+        not_in_local = plex_tv_show_names - local_tv_shows
+
+        if not args.no_state:
+            new_issues, resolved_issues = diff_since_last_run(state, root, not_in_plex, not_in_local)
+            print_changes(plex_changes[root], dir_changes, new_issues, resolved_issues)
+
+        # Suggest likely renames for folders Plex didn't pick up
+        suggestions = {}
+        if not_in_plex and args.suggest > 0:
+            name_index = build_name_index(plex_tv_show_names)
+            suggestions = {show: suggest_matches(name_index, show, args.suggest) for show in not_in_plex}
+
+        print_report(plex_tv_shows, not_in_plex, not_in_local, suggestions)
+
+        if args.files or args.dupes:
+            disk_files = index_files(index[root], root)
+            plex_files = get_plex_files(args.db, root) if args.no_state else load_plex_files(state, root)
+            result = reconcile_files(plex_files, disk_files)
+            if args.files:
+                print_file_report(result, plex_files, disk_files)
+            else:
+                # Orphans are exactly the unindexed files, so only print those
+                print_file_report({'unindexed': result['unindexed']}, plex_files, disk_files, ['unindexed'])
+
+    if args.dupes:
+        # Duplicates can sit in different libraries, so look across every root at once
+        entries = [entry for root in roots for entry in index[root]]
+        print_duplicate_report(find_duplicates(entries, None if args.no_state else state, args.hash_workers))
+
+    if not args.no_state:
+        state.close()
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,333 @@
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import resource
+import multiprocessing
+from io import StringIO
+from datetime import datetime
+from contextlib import redirect_stdout
+
+import plexigator
+
+# Where generated libraries are kept between runs
+WORK_DIR = '/tmp/plexigator_bench'
+
+# Library sizes (media_parts rows) benchmarked when none are given
+DEFAULT_SIZES = [10_000, 100_000]
+
+# Layout of the generated library
+SEASONS_PER_SHOW = 5
+EPISODES_PER_SEASON = 20
+
+# Share of rows that drift between Plex and disk: episodes deleted from disk,
+# episodes Plex hasn't indexed, shows renamed on disk and files resized on disk
+DEFAULT_DRIFT = 0.01
+
+ROWS_PER_INSERT = 10_000
+
+def dataset_dir(work_dir, parts, drift, seed):
+    return os.path.join(work_dir, f'parts{parts}-drift{drift}-seed{seed}')
+
+def create_plex_schema(conn):
+    # Just the parts of the Plex schema plexigator reads, with Plex's index on file
+    conn.executescript('''
+        CREATE TABLE library_sections (id INTEGER PRIMARY KEY, name TEXT, section_type INTEGER);
+        CREATE TABLE section_locations (id INTEGER PRIMARY KEY, library_section_id INTEGER, root_path TEXT);
+        CREATE TABLE metadata_items (id INTEGER PRIMARY KEY, library_section_id INTEGER, title TEXT);
+        CREATE TABLE media_items (id INTEGER PRIMARY KEY, library_section_id INTEGER, metadata_item_id INTEGER);
+        CREATE TABLE media_parts (
+            id INTEGER PRIMARY KEY,
+            media_item_id INTEGER,
+            file TEXT,
+            size INTEGER,
+            created_at INTEGER,
+            updated_at INTEGER
+        );
+        CREATE INDEX index_media_parts_on_file ON media_parts (file);
+        CREATE INDEX index_media_parts_on_media_item_id ON media_parts (media_item_id);
+    ''')
+
+def generate_dataset(path, parts, drift=DEFAULT_DRIFT, seed=0, make_tree=True):
+    # Build plex.db and a matching library/ tree under path, with `drift` of the
+    # rows pushed out of sync in each of the four ways reconciliation reports
+    rng = random.Random(seed)
+    root = os.path.join(path, 'library')
+    db_path = os.path.join(path, 'plex.db')
+    os.makedirs(root, exist_ok=True)
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    conn = sqlite3.connect(db_path)
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    create_plex_schema(conn)
+    conn.execute("INSERT INTO library_sections (id, name, section_type) VALUES (1, 'TV Shows', 2)")
+    conn.execute('INSERT INTO section_locations (library_section_id, root_path) VALUES (1, ?)', (root,))
+
+    per_show = SEASONS_PER_SHOW * EPISODES_PER_SEASON
+    shows = max(1, -(-parts // per_show))
+    renamed = set(rng.sample(range(shows), int(shows * drift)))
+    now = int(time.time())
+
+    rows = []
+    created = 0
+    part_id = 0
+    for show in range(shows):
+        name = f"Show {show:07} ({1950 + show % 70})"
+        disk_name = f"Show {show:07}, The" if show in renamed else name
+        for season in range(1, SEASONS_PER_SHOW + 1):
+            season_dir = os.path.join(root, disk_name, f"Season {season:02}")
+            if make_tree:
+                os.makedirs(season_dir, exist_ok=True)
+            for episode in range(1, EPISODES_PER_SEASON + 1):
+                if part_id >= parts:
+                    break
+                part_id += 1
+                file_name = f"Show {show:07} - S{season:02}E{episode:02}.mkv"
+                size = rng.randint(100_000_000, 4_000_000_000)
+                roll = rng.random()
+                if roll >= drift * 3 or not make_tree:
+                    on_disk, in_plex, disk_size = True, True, size
+                elif roll < drift:
+                    on_disk, in_plex, disk_size = False, True, size
+                elif roll < drift * 2:
+                    on_disk, in_plex, disk_size = True, False, size
+                else:
+                    on_disk, in_plex, disk_size = True, True, size // 2
+
+                if in_plex:
+                    rows.append((part_id, part_id, os.path.join(root, name, f"Season {season:02}", file_name),
+                                 size, now, now - rng.randint(0, 365 * 86400)))
+                if make_tree and on_disk:
+                    # Sparse files: the right size on stat, no space on disk
+                    with open(os.path.join(season_dir, file_name), 'wb') as f:
+                        f.truncate(disk_size)
+                    created += 1
+
+                if len(rows) >= ROWS_PER_INSERT:
+                    insert_parts(conn, rows)
+                    rows = []
+    insert_parts(conn, rows)
+    conn.commit()
+    conn.execute('ANALYZE')
+    conn.close()
+
+    manifest = {'parts': parts, 'drift': drift, 'seed': seed, 'shows': shows,
+                'files_on_disk': created, 'tree': make_tree, 'root': root, 'db': db_path}
+    with open(os.path.join(path, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+def insert_parts(conn, rows):
+    conn.executemany('INSERT INTO metadata_items (id, library_section_id) VALUES (?, 1)', [(row[0],) for row in rows])
+    conn.executemany('INSERT INTO media_items (id, library_section_id, metadata_item_id) VALUES (?, 1, ?)',
+                     [(row[0], row[0]) for row in rows])
+    conn.executemany('INSERT INTO media_parts (id, media_item_id, file, size, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)',
+                     rows)
+
+def load_dataset(work_dir, parts, drift, seed, make_tree):
+    # Reuse a generated dataset if one with the same settings already exists
+    path = dataset_dir(work_dir, parts, drift, seed)
+    try:
+        with open(os.path.join(path, 'manifest.json'), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['tree'] or not make_tree:
+            return manifest
+    except FileNotFoundError:
+        pass
+    print(f"Generating {parts} parts in {path} ...", file=sys.stderr)
+    return generate_dataset(path, parts, drift, seed, make_tree)
+
+# Each scenario gets the manifest, does its untimed setup and returns the
+# callable to time. Anything the stage needs as input is built during setup.
+
+def setup_query_folders(manifest):
+    return lambda: plexigator.get_plex_tv_shows(manifest['db'], manifest['root'])
+
+def setup_query_libraries(manifest):
+    return lambda: plexigator.get_plex_libraries(manifest['db'], [manifest['root']])
+
+def setup_query_files(manifest):
+    return lambda: plexigator.get_plex_files(manifest['db'], manifest['root'])
+
+def setup_scan_top_level(manifest):
+    return lambda: plexigator.scan_libraries([manifest['root']], recursive=False)
+
+def setup_scan_tree(manifest):
+    return lambda: plexigator.scan_libraries([manifest['root']], recursive=True)
+
+def setup_sync_initial(manifest):
+    state_path = os.path.join(os.path.dirname(manifest['db']), 'state-initial.db')
+    if os.path.exists(state_path):
+        os.remove(state_path)
+
+    def run():
+        state = plexigator.open_state_db(state_path)
+        plexigator.sync_plex_parts(state, manifest['db'], manifest['root'])
+        plexigator.sync_local_dirs(state, manifest['root'])
+        state.close()
+    return run
+
+def setup_sync_rerun(manifest):
+    # Sync once untimed, then time a rerun where nothing changed
+    state_path = os.path.join(os.path.dirname(manifest['db']), 'state-rerun.db')
+    if os.path.exists(state_path):
+        os.remove(state_path)
+    state = plexigator.open_state_db(state_path)
+    plexigator.sync_plex_parts(state, manifest['db'], manifest['root'])
+    plexigator.sync_local_dirs(state, manifest['root'])
+
+    def run():
+        plexigator.sync_plex_parts(state, manifest['db'], manifest['root'])
+        plexigator.sync_local_dirs(state, manifest['root'])
+    return run
+
+def setup_diff_folders(manifest):
+    plex_tv_shows = plexigator.get_plex_tv_shows(manifest['db'], manifest['root'])
+    local_tv_shows = plexigator.get_local_tv_shows(manifest['root'])
+
+    def run():
+        plex_tv_show_names = set(plex_tv_shows.keys())
+        not_in_plex = local_tv_shows - plex_tv_show_names
+        not_in_local = plex_tv_show_names - local_tv_shows
+        name_index = plexigator.build_name_index(plex_tv_show_names)
+        suggestions = {show: plexigator.suggest_matches(name_index, show) for show in not_in_plex}
+        with redirect_stdout(StringIO()):
+            plexigator.print_report(plex_tv_shows, not_in_plex, not_in_local, suggestions)
+    return run
+
+def setup_diff_files(manifest):
+    root = manifest['root']
+    plex_files = plexigator.get_plex_files(manifest['db'], root)
+    disk_files = plexigator.index_files(plexigator.scan_libraries([root])[root], root)
+
+    def run():
+        result = plexigator.reconcile_files(plex_files, disk_files)
+        with redirect_stdout(StringIO()):
+            plexigator.print_file_report(result, plex_files, disk_files)
+    return run
+
+SCENARIOS = {
+    'query_folders': setup_query_folders,
+    'query_libraries': setup_query_libraries,
+    'query_files': setup_query_files,
+    'scan_top_level': setup_scan_top_level,
+    'scan_tree': setup_scan_tree,
+    'sync_initial': setup_sync_initial,
+    'sync_rerun': setup_sync_rerun,
+    'diff_folders': setup_diff_folders,
+    'diff_files': setup_diff_files,
+}
+
+# Scenarios that need the directory tree on disk
+TREE_SCENARIOS = {'scan_top_level', 'scan_tree', 'sync_initial', 'sync_rerun', 'diff_folders', 'diff_files'}
+
+def run_scenario(name, manifest, results):
+    # Runs in a fresh process so peak RSS belongs to this scenario alone
+    stage = SCENARIOS[name](manifest)
+    setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    stage()
+    elapsed = time.perf_counter() - start
+    results.put({
+        'wall_seconds': elapsed,
+        'peak_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'setup_rss_kib': setup_rss,
+    })
+
+def measure(name, manifest, repeat):
+    # Best wall time over `repeat` runs, each in its own spawned process
+    context = multiprocessing.get_context('spawn')
+    runs = []
+    for _ in range(repeat):
+        results = context.Queue()
+        process = context.Process(target=run_scenario, args=(name, manifest, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Scenario {name} failed with exit code {process.exitcode}")
+        runs.append(results.get())
+    best = min(runs, key=lambda run: run['wall_seconds'])
+    return {
+        'scenario': name,
+        'parts': manifest['parts'],
+        'wall_seconds': best['wall_seconds'],
+        'wall_seconds_all': [run['wall_seconds'] for run in runs],
+        'peak_rss_kib': max(run['peak_rss_kib'] for run in runs),
+        'setup_rss_kib': best['setup_rss_kib'],
+    }
+
+def compare(results, baseline_path):
+    # Print the change against an earlier results file, slowest regressions first
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = {(row['parts'], row['scenario']): row for row in json.load(f)['results']}
+
+    rows = []
+    for row in results:
+        old = baseline.get((row['parts'], row['scenario']))
+        if old:
+            time_change = row['wall_seconds'] / old['wall_seconds'] - 1 if old['wall_seconds'] else 0
+            rss_change = row['peak_rss_kib'] / old['peak_rss_kib'] - 1 if old['peak_rss_kib'] else 0
+            rows.append((time_change, rss_change, row))
+
+    print(f"\nCompared with {baseline_path}:")
+    for time_change, rss_change, row in sorted(rows, key=lambda item: item[0], reverse=True):
+        print(f"{row['scenario']:>16} @ {row['parts']:>9}: time {time_change:+7.1%}, peak RSS {rss_change:+7.1%}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark plexigator against generated Plex libraries.")
+    parser.add_argument("--sizes", default=','.join(map(str, DEFAULT_SIZES)), help="Comma separated media_parts counts, e.g. 10000,1000000")
+    parser.add_argument("--drift", type=float, default=DEFAULT_DRIFT, help="Share of rows out of sync in each of the four ways")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the generator")
+    parser.add_argument("--work-dir", default=WORK_DIR, help="Where generated datasets are kept")
+    parser.add_argument("--no-tree", action="store_true", help="Only generate the database and skip the filesystem scenarios")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS), help="Scenario to run, may be repeated (default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario; the fastest is reported")
+    parser.add_argument("--generate-only", action="store_true", help="Build the datasets and exit")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--compare", help="Earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+    scenarios = args.scenario or list(SCENARIOS)
+    if args.no_tree:
+        scenarios = [name for name in scenarios if name not in TREE_SCENARIOS]
+
+    manifests = [load_dataset(args.work_dir, parts, args.drift, args.seed, not args.no_tree) for parts in sizes]
+    if args.generate_only:
+        return
+
+    results = []
+    for manifest in manifests:
+        for name in scenarios:
+            row = measure(name, manifest, args.repeat)
+            results.append(row)
+            print(f"{name:>16} @ {manifest['parts']:>9}: {row['wall_seconds']:9.3f}s, "
+                  f"peak RSS {row['peak_rss_kib'] / 1024:8.1f} MiB")
+
+    report = {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'drift': args.drift,
+            'seed': args.seed,
+            'repeat': args.repeat,
+        },
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()